@@ -0,0 +1,95 @@
+"""Query latency of :class:`notes.search.FullTextIndex`.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_search --notes 1000000
+
+Notes are synthetic: words are drawn from a Zipf-like vocabulary so that a
+few terms are very common and most are rare, as in real text. Queries mix
+two to four words drawn from the same distribution.
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+
+from notes.search import FullTextIndex
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def _report(label: str, index: FullTextIndex, queries: list[str]) -> None:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, 10)
+        latencies.append(time.perf_counter() - start)
+    print(f"{label}: p50 {_percentile(latencies, 50) * 1e3:.2f}ms "
+          f"p99 {_percentile(latencies, 99) * 1e3:.2f}ms "
+          f"max {max(latencies) * 1e3:.2f}ms over {len(queries)} queries")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--notes", type=int, default=1_000_000)
+    parser.add_argument("--words", type=int, default=40, help="words per note")
+    parser.add_argument("--vocabulary", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=1_000)
+    parser.add_argument("--edits", type=float, default=0.05,
+                        help="fraction of notes re-indexed after the initial load")
+    parser.add_argument("--dir", help="directory for the index (default: a temp dir)")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocabulary = [f"w{i}" for i in range(args.vocabulary)]
+    cum_weights = list(
+        itertools.accumulate(1 / (rank + 1) for rank in range(args.vocabulary))
+    )
+
+    def text(n: int) -> str:
+        return " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=n))
+
+    directory = args.dir or tempfile.mkdtemp(prefix="notes-bench-")
+    index = FullTextIndex(os.path.join(directory, "index.db"))
+
+    start = time.perf_counter()
+    for i in range(args.notes):
+        index.add(str(i), text(args.words), 0.0)
+    index.commit()
+    elapsed = time.perf_counter() - start
+    print(f"index: {args.notes} notes in {elapsed:.1f}s "
+          f"({args.notes / elapsed:,.0f} notes/s)")
+
+    edits = int(args.notes * args.edits)
+    start = time.perf_counter()
+    for i in rng.sample(range(args.notes), edits):
+        index.add(str(i), text(args.words), 1.0)
+    index.commit()
+    elapsed = time.perf_counter() - start
+    if edits:
+        print(f"edit: {edits} notes re-indexed in {elapsed:.1f}s")
+
+    queries = [text(rng.randint(2, 4)) for _ in range(args.queries)]
+    _report("search", index, queries)
+
+    index.close()
+    del index
+    start = time.perf_counter()
+    index = FullTextIndex(os.path.join(directory, "index.db"))
+    print(f"reopen: {time.perf_counter() - start:.2f}s")
+    # the same queries again, now reading each posting list the first time
+    # it is needed
+    _report("search after reopen", index, queries)
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Write throughput and read latency of :class:`notes.NoteStore`.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_storage --notes 1000000
+
+The store is built in a temporary directory unless ``--dir`` is given.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from notes import NoteStore
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--notes", type=int, default=1_000_000)
+    parser.add_argument("--body-size", type=int, default=256)
+    parser.add_argument("--reads", type=int, default=100_000)
+    parser.add_argument("--updates", type=float, default=0.1,
+                        help="fraction of notes updated after the initial load")
+    parser.add_argument("--dir", help="directory for the log (default: a temp dir)")
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="notes-bench-")
+    path = os.path.join(directory, "notes.log")
+    body = "x" * args.body_size
+
+    with NoteStore(path) as store:
+        start = time.perf_counter()
+        ids = [store.create(f"note {i}", body).id for i in range(args.notes)]
+        store.sync()
+        elapsed = time.perf_counter() - start
+        print(f"create: {args.notes} notes in {elapsed:.2f}s "
+              f"({args.notes / elapsed:,.0f} writes/s)")
+
+        updated = random.sample(ids, int(len(ids) * args.updates))
+        start = time.perf_counter()
+        for note_id in updated:
+            store.update(note_id, body=body[::-1])
+        store.sync()
+        elapsed = time.perf_counter() - start
+        if updated:
+            print(f"update: {len(updated)} notes in {elapsed:.2f}s "
+                  f"({len(updated) / elapsed:,.0f} writes/s)")
+
+        latencies = []
+        for note_id in random.choices(ids, k=args.reads):
+            start = time.perf_counter()
+            store.get(note_id)
+            latencies.append(time.perf_counter() - start)
+        print(f"get: p50 {_percentile(latencies, 50) * 1e6:.1f}us "
+              f"p99 {_percentile(latencies, 99) * 1e6:.1f}us "
+              f"over {args.reads} random reads")
+
+        start = time.perf_counter()
+        store.compact()
+        print(f"compact: {time.perf_counter() - start:.2f}s, "
+              f"log is {os.path.getsize(path) / 2**20:.1f} MiB")
+
+    start = time.perf_counter()
+    with NoteStore(path) as store:
+        print(f"reopen: {len(store)} notes indexed in "
+              f"{time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Load test for the notes HTTP API.
+
+Run from the repository root::
+
+    python -m benchmarks.loadtest --connections 1000 --duration 10
+
+Without ``--port`` a server is started in a subprocess on a temporary data
+directory and seeded with ``--notes`` notes. Each connection keeps one
+HTTP/1.1 keep-alive socket open and issues a mix of note fetches (half of
+them conditional, as polling clients do), list pages, searches and
+updates. Requests per second and latency percentiles are reported per
+request kind and overall.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+class Client:
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+
+    async def connect(self) -> None:
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port
+        )
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes = b"",
+        headers: dict[str, str] | None = None,
+    ) -> tuple[int, dict[str, str], bytes]:
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}"]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        if body:
+            lines.append(f"Content-Length: {len(body)}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        response_headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(":")
+                response_headers[name.strip().lower()] = value.strip()
+        if "content-length" in response_headers:
+            length = int(response_headers["content-length"])
+            data = await self.reader.readexactly(length)
+        else:
+            data = b""
+        return int(status_line.split(" ")[1]), response_headers, data
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+async def _seed(host: str, port: int, count: int, words: list[str]) -> list[str]:
+    client = Client(host, port)
+    await client.connect()
+    ids = []
+    for i in range(count):
+        body = json.dumps(
+            {"title": f"note {i}", "body": " ".join(random.choices(words, k=50))}
+        ).encode()
+        _, _, data = await client.request("POST", "/notes", body)
+        ids.append(json.loads(data)["id"])
+    client.close()
+    return ids
+
+
+async def _worker(
+    host: str,
+    port: int,
+    ids: list[str],
+    words: list[str],
+    deadline: float,
+    latencies: dict[str, list[float]],
+    statuses: dict[int, int],
+) -> None:
+    client = Client(host, port)
+    await client.connect()
+    etags: dict[str, str] = {}
+    try:
+        while time.perf_counter() < deadline:
+            roll = random.random()
+            note_id = random.choice(ids)
+            headers = {}
+            body = b""
+            if roll < 0.5:
+                kind, method, path = "get", "GET", f"/notes/{note_id}"
+                if note_id in etags and random.random() < 0.5:
+                    kind = "get-conditional"
+                    headers["If-None-Match"] = etags[note_id]
+            elif roll < 0.75:
+                kind, method, path = "list", "GET", "/notes?limit=20"
+            elif roll < 0.95:
+                kind, method = "search", "GET"
+                path = f"/search?q={random.choice(words)}+{random.choice(words)}"
+            else:
+                kind, method, path = "update", "PUT", f"/notes/{note_id}"
+                text = " ".join(random.choices(words, k=50))
+                body = json.dumps({"body": text}).encode()
+            start = time.perf_counter()
+            status, response_headers, _ = await client.request(
+                method, path, body, headers
+            )
+            latencies[kind].append(time.perf_counter() - start)
+            statuses[status] += 1
+            if kind.startswith("get") and "etag" in response_headers:
+                etags[note_id] = response_headers["etag"]
+    finally:
+        client.close()
+
+
+async def _run(args: argparse.Namespace, host: str, port: int) -> None:
+    words = [f"word{i}" for i in range(2000)]
+    ids = await _seed(host, port, args.notes, words)
+    latencies: dict[str, list[float]] = defaultdict(list)
+    statuses: dict[int, int] = defaultdict(int)
+    deadline = time.perf_counter() + args.duration
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            _worker(host, port, ids, words, deadline, latencies, statuses)
+            for _ in range(args.connections)
+        ),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - start
+    failures = [r for r in results if isinstance(r, BaseException)]
+
+    total = sum(len(samples) for samples in latencies.values())
+    print(f"{args.connections} connections, {elapsed:.1f}s, "
+          f"{total / elapsed:,.0f} requests/s, {len(failures)} failed connections")
+    everything = [x for samples in latencies.values() for x in samples]
+    for kind, samples in sorted(latencies.items()) + [("all", everything)]:
+        if samples:
+            print(f"  {kind:16} {len(samples):8d} req  "
+                  f"p50 {_percentile(samples, 50) * 1e3:7.2f}ms  "
+                  f"p99 {_percentile(samples, 99) * 1e3:7.2f}ms")
+    print("  status codes:", dict(sorted(statuses.items())))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument(
+        "--port", type=int, help="port of a running server (default: spawn one)"
+    )
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--notes", type=int, default=1000, help="notes to seed")
+    args = parser.parse_args()
+
+    server = None
+    port = args.port
+    if port is None:
+        port = random.randint(20000, 60000)
+        server = subprocess.Popen(
+            [sys.executable, "-m", "notes.server", "--data",
+             tempfile.mkdtemp(prefix="notes-load-"), "--host", args.host,
+             "--port", str(port)],
+            env=dict(os.environ, PYTHONPATH=os.getcwd()),
+            stderr=subprocess.DEVNULL,
+        )
+        for _ in range(100):
+            try:
+                socket.create_connection((args.host, port)).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+    try:
+        asyncio.run(_run(args, args.host, port))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+"""Storage and services for the simple notes app."""
+
+from notes.storage import (
+    Note,
+    NoteNotFound,
+    NoteReader,
+    NoteStore,
+    VersionConflict,
+)
+
+__all__ = ["Note", "NoteNotFound", "NoteReader", "NoteStore", "VersionConflict"]
@@ -0,0 +1,375 @@
+"""Semantic note search over a ``notes_embeddings`` collection.
+
+The collection follows the Milvus Lite layout used for
+``file_search_terms_embeddings``: a ``collection_meta`` table describing the
+schema (an ID, a 4096-character text field and a 1536-dimensional embedding)
+and its index, plus one table of
+``(id, milvus_id, data)`` rows. Metadata is stored as JSON rather than
+protobuf, and ``data`` packs the note version, text and float32 vector.
+
+Embedding never happens on the save path. :meth:`NoteEmbeddings.schedule`
+only queues the note; a background worker drains the queue in batches,
+coalescing repeated saves of the same note, embeds each batch with a single
+embedder call and writes it in one transaction. A batch the embedder fails
+on is retried, with a growing delay, until it is written or the collection
+is closed.
+
+Notes collections are small enough that related-note queries use exact
+cosine search, so the index is recorded as ``FLAT``; the scan is one NumPy
+matrix product per segment of :data:`SEGMENT_ROWS` float32 vectors. Rows
+are only ever appended: a re-embedded note gets a new row, its old row is
+marked dead, and the segments are rebuilt once dead rows outnumber live
+ones. A batch thus writes only its own rows, and queries score the rows
+that existed when they started without holding the lock.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import math
+import queue
+import sqlite3
+import struct
+import threading
+from array import array
+from typing import Optional, Protocol, Sequence
+
+import numpy
+
+from notes.search import tokenize
+
+log = logging.getLogger(__name__)
+
+COLLECTION = "notes_embeddings"
+DIM = 1536
+TEXT_MAX_LENGTH = 4096
+SEGMENT_ROWS = 1024
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS collection_meta (
+    id INTEGER PRIMARY KEY,
+    collection_name VARCHAR(1024),
+    meta_type VARCHAR(1024),
+    blob_field BLOB,
+    string_field VARCHAR(1024)
+);
+CREATE TABLE IF NOT EXISTS "{COLLECTION}" (
+    id INTEGER PRIMARY KEY,
+    milvus_id VARCHAR(1024),
+    data BLOB
+);
+CREATE UNIQUE INDEX IF NOT EXISTS "{COLLECTION}_milvus_id"
+    ON "{COLLECTION}" (milvus_id);
+"""
+
+# note version, text length in bytes
+_ROW_HEADER = struct.Struct("<dI")
+
+_STOP = object()
+
+
+class Embedder(Protocol):
+    dim: int
+    version: str
+
+    def embed(self, texts: Sequence[str]) -> list[array]:
+        """Return one L2-normalized ``array("f")`` of ``dim`` floats per text."""
+
+
+class HashingEmbedder:
+    """Local stand-in embedder using signed feature hashing of tokens."""
+
+    def __init__(self, dim: int = DIM) -> None:
+        self.dim = dim
+        self.version = f"hashing-v1-{dim}"
+
+    def embed(self, texts: Sequence[str]) -> list[array]:
+        vectors = []
+        for text in texts:
+            vector = array("f", bytes(4 * self.dim))
+            for token in tokenize(text):
+                digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+                h = int.from_bytes(digest, "little")
+                vector[h % self.dim] += -1.0 if h >> 63 else 1.0
+            norm = math.sqrt(sum(x * x for x in vector))
+            if norm:
+                vector = array("f", (x / norm for x in vector))
+            vectors.append(vector)
+        return vectors
+
+
+def note_text(title: str, body: str) -> str:
+    return f"{title}\n{body}"[:TEXT_MAX_LENGTH]
+
+
+class NoteEmbeddings:
+    """Asynchronously maintained embedding collection for notes."""
+
+    def __init__(
+        self,
+        path: str,
+        embedder: Optional[Embedder] = None,
+        *,
+        batch_size: int = 64,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 60.0,
+    ) -> None:
+        self.embedder = embedder or HashingEmbedder()
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.dim = self.embedder.dim
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._write_meta()
+
+        # Segments of SEGMENT_ROWS vectors; row i is row i % SEGMENT_ROWS
+        # of segment i // SEGMENT_ROWS and was embedded for self._ids[i].
+        # Only the worker changes them, and only by appending rows.
+        self._segments: list[numpy.ndarray] = []
+        self._ids: list[str] = []
+        # whether each row is its note's current one; grown by replacement
+        self._live = numpy.zeros(0, bool)
+        self._rows: dict[str, int] = {}
+        self._versions: dict[str, float] = {}
+        self._load()
+
+        self._closing = threading.Event()
+        self._queue: queue.Queue = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run, name="notes-embeddings", daemon=True
+        )
+        self._worker.start()
+
+    # -- public API -------------------------------------------------------
+
+    def schedule(self, note_id: str, text: str, version: float) -> None:
+        """Queue a note for (re-)embedding; returns immediately."""
+        self._queue.put((note_id, text, version))
+
+    def schedule_delete(self, note_id: str) -> None:
+        self._queue.put((note_id, None, None))
+
+    def flush(self) -> None:
+        """Block until every scheduled change has been written."""
+        self._queue.join()
+
+    def versions(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._versions)
+
+    def related(self, note_id: str, k: int = 10) -> list[tuple[str, float]]:
+        """Return up to ``k`` ``(note_id, similarity)`` pairs most like a note.
+
+        Only positively similar notes are returned, and none at all if the
+        note has not been embedded yet.
+        """
+        with self._lock:
+            row = self._rows.get(note_id)
+            if row is None:
+                return []
+            vector = self._segments[row // SEGMENT_ROWS][row % SEGMENT_ROWS]
+        hits = self._nearest(vector, k + 1)
+        return [hit for hit in hits if hit[0] != note_id and hit[1] > 0][:k]
+
+    def similar(self, text: str, k: int = 10) -> list[tuple[str, float]]:
+        """Return up to ``k`` ``(note_id, similarity)`` pairs most like ``text``."""
+        vector = self.embedder.embed([text])[0]
+        return self._nearest(numpy.frombuffer(vector, numpy.float32), k)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def close(self) -> None:
+        self._closing.set()
+        self._queue.put(_STOP)
+        self._worker.join()
+        self._db.close()
+
+    # -- internals --------------------------------------------------------
+
+    def _nearest(self, vector: numpy.ndarray, k: int) -> list[tuple[str, float]]:
+        with self._lock:
+            segments, ids = self._segments, self._ids
+            live = self._live[:len(ids)].copy()
+        count = int(live.sum())
+        if not count:
+            return []
+        used = segments[:-(-len(live) // SEGMENT_ROWS)]
+        scores = numpy.concatenate([segment @ vector for segment in used])
+        scores = scores[:len(live)]
+        scores[~live] = -numpy.inf
+        k = min(k, count)
+        if k < len(scores):
+            top = numpy.argpartition(-scores, k)[:k]
+            top = top[numpy.argsort(-scores[top])]
+        else:
+            top = numpy.argsort(-scores)[:k]
+        return [(ids[i], float(scores[i])) for i in top]
+
+    def _run(self) -> None:
+        delay = 0.0
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while item is not _STOP and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            stop = batch[-1] is _STOP
+            changes = {entry[0]: entry for entry in batch if entry is not _STOP}
+            while changes:
+                try:
+                    self._apply(list(changes.values()))
+                except Exception:
+                    delay = min(max(2 * delay, self.retry_delay), self.max_retry_delay)
+                    log.exception(
+                        "failed to embed %d notes, retrying in %gs",
+                        len(changes),
+                        delay,
+                    )
+                    if self._closing.wait(delay):
+                        # Their old versions stay behind in the collection,
+                        # so they are embedded again on the next open.
+                        log.warning("closing with %d notes not embedded", len(changes))
+                        break
+                else:
+                    delay = 0.0
+                    break
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _apply(self, changes: list[tuple]) -> None:
+        upserts = [change for change in changes if change[1] is not None]
+        deletes = [change[0] for change in changes if change[1] is None]
+        vectors = self.embedder.embed([text for _, text, _ in upserts])
+        rows = []
+        for (note_id, text, version), vector in zip(upserts, vectors):
+            encoded = text.encode()
+            header = _ROW_HEADER.pack(version, len(encoded))
+            rows.append((note_id, header + encoded + vector.tobytes()))
+        with self._db:
+            self._db.executemany(
+                f'DELETE FROM "{COLLECTION}" WHERE milvus_id = ?',
+                [(note_id,) for note_id in deletes],
+            )
+            self._db.executemany(
+                f'INSERT INTO "{COLLECTION}" (milvus_id, data) VALUES (?, ?)'
+                " ON CONFLICT (milvus_id) DO UPDATE SET data = excluded.data",
+                rows,
+            )
+        with self._lock:
+            for note_id in deletes:
+                self._remove_row(note_id)
+            for (note_id, _, version), vector in zip(upserts, vectors):
+                self._put_row(note_id, vector, version)
+        if len(self._ids) - len(self._rows) > max(len(self._rows), SEGMENT_ROWS):
+            self._rebuild()
+
+    def _put_row(self, note_id: str, vector: array, version: float) -> None:
+        self._remove_row(note_id)
+        row = len(self._ids)
+        if row % SEGMENT_ROWS == 0:
+            self._segments.append(
+                numpy.empty((SEGMENT_ROWS, self.dim), numpy.float32)
+            )
+        self._segments[-1][row % SEGMENT_ROWS] = vector
+        if row == len(self._live):
+            # Queries may still hold the old mask.
+            live = numpy.zeros(2 * row + SEGMENT_ROWS, bool)
+            live[:row] = self._live
+            self._live = live
+        self._live[row] = True
+        self._ids.append(note_id)
+        self._rows[note_id] = row
+        self._versions[note_id] = version
+
+    def _remove_row(self, note_id: str) -> None:
+        row = self._rows.pop(note_id, None)
+        if row is not None:
+            self._live[row] = False
+            del self._versions[note_id]
+
+    def _rebuild(self) -> None:
+        """Copy the live rows into fresh segments, dropping the dead ones.
+
+        Only the worker changes rows, so the copy is made without the lock
+        and swapped in under it.
+        """
+        rows = numpy.flatnonzero(self._live[:len(self._ids)])
+        segments = []
+        for start in range(0, len(rows), SEGMENT_ROWS):
+            part = rows[start:start + SEGMENT_ROWS]
+            segment = numpy.empty((SEGMENT_ROWS, self.dim), numpy.float32)
+            where = part // SEGMENT_ROWS
+            for old in numpy.unique(where).tolist():
+                pick = where == old
+                segment[:len(part)][pick] = self._segments[old][
+                    part[pick] % SEGMENT_ROWS
+                ]
+            segments.append(segment)
+        ids = [self._ids[row] for row in rows.tolist()]
+        live = numpy.zeros(len(ids) + SEGMENT_ROWS, bool)
+        live[:len(ids)] = True
+        with self._lock:
+            self._segments, self._ids, self._live = segments, ids, live
+            self._rows = {note_id: row for row, note_id in enumerate(ids)}
+
+    def _write_meta(self) -> None:
+        schema = {
+            "name": COLLECTION,
+            "description": "Note title and body embeddings",
+            "fields": [
+                {"name": "id", "type": "Int64", "is_primary": True, "auto_id": True},
+                {"name": "note_id", "type": "VarChar", "max_length": 64},
+                {"name": "text", "type": "VarChar", "max_length": TEXT_MAX_LENGTH},
+                {"name": "embedding", "type": "FloatVector", "dim": self.dim},
+            ],
+            "embedder": self.embedder.version,
+        }
+        index = {
+            "field_name": "embedding",
+            "index_type": "FLAT",
+            "metric_type": "COSINE",
+            "params": {},
+            "dim": self.dim,
+        }
+        with self._db:
+            row = self._db.execute(
+                "SELECT blob_field FROM collection_meta"
+                " WHERE collection_name = ? AND meta_type = 'schema'",
+                (COLLECTION,),
+            ).fetchone()
+            stored = json.loads(row[0]) if row is not None else {}
+            if stored and stored.get("embedder") != schema["embedder"]:
+                # Vectors from another embedder are not comparable; start over.
+                self._db.execute(f'DELETE FROM "{COLLECTION}"')
+            self._db.execute(
+                "DELETE FROM collection_meta WHERE collection_name = ?", (COLLECTION,)
+            )
+            self._db.executemany(
+                "INSERT INTO collection_meta"
+                " (collection_name, meta_type, blob_field, string_field)"
+                " VALUES (?, ?, ?, ?)",
+                [
+                    (COLLECTION, "schema", json.dumps(schema).encode(), "id"),
+                    (COLLECTION, "index", json.dumps(index).encode(), "embedding"),
+                ],
+            )
+
+    def _load(self) -> None:
+        for note_id, data in self._db.execute(
+            f'SELECT milvus_id, data FROM "{COLLECTION}" ORDER BY id'
+        ):
+            version, length = _ROW_HEADER.unpack_from(data)
+            vector = array("f")
+            vector.frombytes(data[_ROW_HEADER.size + length:])
+            self._put_row(note_id, vector, version)
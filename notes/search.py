@@ -0,0 +1,981 @@
+"""BM25 full-text index over notes.
+
+Corpus statistics use the same ``bm25_stats`` and ``token_doc_count``
+tables as the Milvus Lite store under ``.knowledge/.vector_db``, keyed by
+this index's own ``collection_name``. Tokens are stored as signed 64-bit
+hashes, matching the INTEGER ``token`` column of that schema.
+
+On disk, posting lists are compressed in blocks of :data:`BLOCK` entries.
+A block stores its doc-number gaps in the narrowest unsigned array type
+that fits them, so a list of a common term costs about one byte per gap
+plus one byte of term frequency. Each block also records its largest term
+frequency and its shortest document, which together bound the score any
+note in the block can get from the term. Every indexed version of a note
+gets a fresh, increasing doc number, so edits only ever append to posting
+lists. The old doc number is dropped from the document table and its
+postings are skipped at query time until the token's list is mostly dead,
+that is until dead postings outnumber live ones, at which point only that
+list is rewritten.
+
+Each block is its own row in the ``postings`` table. A full block never
+changes once written, so a commit writes only the blocks filled since the
+last one and the open tail of each touched list, not whole lists. Opening
+an index reads the document table and the lists of the few tokens common
+enough to hold one in :data:`_PRELOAD` doc numbers; any other token's list
+and count are read the first time a query or an edit needs them. All of a
+list's blocks are decoded at once with NumPy.
+
+In memory, a list is kept decoded as flat arrays of doc numbers and term
+frequencies, so queries are NumPy array operations rather than a Python
+loop per posting. Queries are term-at-a-time MaxScore. Terms are taken
+highest bound first. The notes found so far are looked up in each later
+term, through a dense array of term frequencies by doc number for common
+terms, and dropped once the bounds of the terms after it cannot lift them
+into the top ``k``. New notes are only taken from postings whose score
+could still do so, and blocks whose bound rules that out are skipped. The
+top ``k`` threshold starts from the full scores of a few promising notes,
+so that for a common term only its postings of high term frequency pass.
+
+All changes are held in memory and written by :meth:`FullTextIndex.commit`
+in a single transaction, together with the delta-updated statistics. A
+commit can also be split in two: :meth:`FullTextIndex.changes` encodes the
+pending rows under the index's lock, while :meth:`FullTextIndex.write` only
+touches the database and may run alongside edits and queries.
+
+The index may be shared between threads. Edits hold its lock throughout,
+but a query holds it only to take NumPy views of its lists and the corpus
+statistics, and scores without it. An edit that appends to a list a query
+still views appends to a copy instead, so the query keeps its snapshot.
+"""
+
+from __future__ import annotations
+
+import functools
+import hashlib
+import itertools
+import math
+import re
+import sqlite3
+import struct
+import sys
+import threading
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import numpy
+
+BLOCK = 128
+# Term frequencies are stored in one byte; BM25 saturates long before that.
+_MAX_TF = 255
+# gap array typecode, entry count
+_BLOCK_HEADER = struct.Struct("<cH")
+# shortest document of an empty block, so that any real one is shorter
+_NO_LENGTH = sys.maxsize
+# lists holding at least one in this many doc numbers are read on open
+_PRELOAD = 64
+# and those holding one in this many are also kept spread over a dense array
+# of doc numbers
+_COMMON = 16
+# best blocks of each term whose top notes are fully scored up front, to
+# start the top k threshold near its final value
+_SEED_BLOCKS = 64
+
+_TOKEN_RE = re.compile(r"\w+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bm25_stats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection_name VARCHAR(1000),
+    output_field_name VARCHAR(1000),
+    token_num INTEGER,
+    doc_num INTEGER,
+    UNIQUE (collection_name, output_field_name)
+);
+CREATE TABLE IF NOT EXISTS token_doc_count (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection_name VARCHAR,
+    output_field_name VARCHAR,
+    token INTEGER,
+    doc_count INTEGER,
+    UNIQUE (collection_name, output_field_name, token)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    collection_name VARCHAR,
+    output_field_name VARCHAR,
+    token INTEGER,
+    block INTEGER,
+    data BLOB,
+    last_doc INTEGER,
+    max_tf INTEGER,
+    min_length INTEGER,
+    PRIMARY KEY (collection_name, output_field_name, token, block)
+);
+CREATE TABLE IF NOT EXISTS documents (
+    collection_name VARCHAR,
+    output_field_name VARCHAR,
+    doc INTEGER,
+    note_id VARCHAR(64),
+    version REAL,
+    length INTEGER,
+    tokens BLOB,
+    PRIMARY KEY (collection_name, output_field_name, doc)
+);
+"""
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def token_id(token: str) -> int:
+    digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def _gap_typecode(largest: int) -> str:
+    for typecode in "BHIQ":
+        if largest < 1 << (8 * array(typecode).itemsize):
+            return typecode
+    raise OverflowError(largest)
+
+
+def _gaps(base: int, docs: array) -> list[int]:
+    return [doc - prev for prev, doc in zip(itertools.chain((base,), docs), docs)]
+
+
+def _encode_block(base: int, docs: array, tfs: array) -> bytes:
+    gaps = _gaps(base, docs)
+    gaps = array(_gap_typecode(max(gaps)), gaps)
+    header = _BLOCK_HEADER.pack(gaps.typecode.encode(), len(tfs))
+    return header + gaps.tobytes() + tfs.tobytes()
+
+
+@functools.lru_cache(maxsize=None)
+def _block_dtype(typecode: str) -> numpy.dtype:
+    """Return the layout of a full block whose gaps are of ``typecode``."""
+    return numpy.dtype([
+        ("header", f"V{_BLOCK_HEADER.size}"),
+        ("gaps", typecode, (BLOCK,)),
+        ("tfs", numpy.uint8, (BLOCK,)),
+    ])
+
+
+def _append(values: array, value: int) -> array:
+    """Append ``value`` to ``values``, or to a copy of them if a running
+    query holds a view of them, and return the array appended to."""
+    try:
+        values.append(value)
+    except BufferError:
+        values = values[:]
+        values.append(value)
+    return values
+
+
+def _kth(scores: numpy.ndarray, k: int, floor: float = 0.0) -> float:
+    """Return the ``k``-th highest of ``scores``, or ``floor`` if that is
+    higher."""
+    # most scores are usually below the floor, and many are equal, which
+    # makes partitioning all of them slow
+    scores = scores[scores > floor]
+    if len(scores) < k:
+        return floor
+    return float(numpy.partition(scores, len(scores) - k)[len(scores) - k])
+
+
+@dataclass
+class _Doc:
+    note_id: str
+    version: float
+    length: int
+    # unique token ids, array("q"); read from the database when None
+    tokens: Optional[array]
+
+
+class _Postings:
+    """Posting list held decoded in memory and block-compressed on disk."""
+
+    __slots__ = (
+        "docs",
+        "tfs",
+        "max_tfs",
+        "min_lengths",
+        "tail_min_length",
+        "max_tf",
+        "min_length",
+        "df",
+        "stored",
+        "spread",
+        "spread_count",
+    )
+
+    def __init__(self, df: int = 0) -> None:
+        # ascending doc numbers and their term frequencies; entries past
+        # the last full block of BLOCK form the open tail
+        self.docs = array("q")
+        self.tfs = array("B")
+        # largest tf and shortest document per full block
+        self.max_tfs = array("B")
+        self.min_lengths = array("q")
+        self.tail_min_length = _NO_LENGTH
+        # the same over the whole list, dead postings included
+        self.max_tf = 0
+        self.min_length = _NO_LENGTH
+        # live documents holding the token
+        self.df = df
+        # full blocks already written to the database
+        self.stored = 0
+        # term frequencies by doc number, see dense(), and the postings in it
+        self.spread: Optional[numpy.ndarray] = None
+        self.spread_count = 0
+
+    @property
+    def dead(self) -> int:
+        return len(self) - self.df
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def append(self, doc: int, tf: int, length: int) -> None:
+        tf = min(tf, _MAX_TF)
+        self.docs = _append(self.docs, doc)
+        self.tfs = _append(self.tfs, tf)
+        self.tail_min_length = min(self.tail_min_length, length)
+        self.max_tf = max(self.max_tf, tf)
+        self.min_length = min(self.min_length, length)
+        if len(self.docs) == (len(self.max_tfs) + 1) * BLOCK:
+            self.max_tfs = _append(self.max_tfs, max(self.tfs[-BLOCK:]))
+            self.min_lengths = _append(self.min_lengths, self.tail_min_length)
+            self.tail_min_length = _NO_LENGTH
+
+    def arrays(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """Return the doc numbers and term frequencies as NumPy views.
+
+        The views pin the underlying arrays: postings appended while they
+        are held go to copies, so the views keep showing the list as it was
+        when they were taken.
+        """
+        return (
+            numpy.frombuffer(self.docs, numpy.int64),
+            numpy.frombuffer(self.tfs, numpy.uint8),
+        )
+
+    def dense(self, size: int) -> Optional[numpy.ndarray]:
+        """Return the term frequencies indexed by doc number, over at least
+        ``size`` doc numbers, or None for a list too short to keep them so.
+
+        They are kept for lists holding at least one in :data:`_COMMON` doc
+        numbers, where they take at most about twice the memory of the list
+        itself, and catch up with the postings appended since the last call.
+        """
+        if len(self.docs) * _COMMON < size:
+            self.spread = None
+            self.spread_count = 0
+            return None
+        spread = self.spread
+        if spread is None or len(spread) < size:
+            self.spread = numpy.zeros(size, numpy.uint8)
+            if spread is not None:
+                self.spread[:len(spread)] = spread
+            spread = self.spread
+        docs, tfs = self.arrays()
+        count = self.spread_count
+        spread[docs[count:]] = tfs[count:]
+        self.spread_count = len(docs)
+        return spread
+
+    def block_stats(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """Return the largest tf and shortest document of each block, the
+        open tail last."""
+        max_tfs = numpy.frombuffer(self.max_tfs, numpy.uint8)
+        min_lengths = numpy.frombuffer(self.min_lengths, numpy.int64)
+        tail = len(self.max_tfs) * BLOCK
+        if len(self.docs) > tail:
+            max_tfs = numpy.append(max_tfs, max(self.tfs[tail:]))
+            min_lengths = numpy.append(min_lengths, self.tail_min_length)
+        return max_tfs, min_lengths
+
+    def rows(self) -> int:
+        """Return the number of database rows this list takes."""
+        return -(-len(self.docs) // BLOCK)
+
+    def unstored(self) -> list[tuple[int, bytes, int, int, int]]:
+        """Return ``(block, data, last_doc, max_tf, min_length)`` rows not
+        yet in the database.
+
+        That is every block filled since the last call, and the tail.
+        """
+        rows = []
+        docs, tfs = self.docs, self.tfs
+        for i in range(self.stored, self.rows()):
+            start = i * BLOCK
+            end = min(start + BLOCK, len(docs))
+            if i < len(self.max_tfs):
+                max_tf, min_length = self.max_tfs[i], self.min_lengths[i]
+            else:
+                max_tf, min_length = max(tfs[start:]), self.tail_min_length
+            data = _encode_block(
+                docs[start - 1] if start else 0, docs[start:end], tfs[start:end]
+            )
+            rows.append((i, data, docs[end - 1], max_tf, min_length))
+        self.stored = len(self.max_tfs)
+        return rows
+
+    @classmethod
+    def from_rows(
+        cls, rows: Iterable[tuple[bytes, int, int]], df: int
+    ) -> "_Postings":
+        """Rebuild a list from its ``(data, max_tf, min_length)`` rows, in
+        block order.
+
+        Each block's first gap is from the last doc of the block before, so
+        the gaps of all blocks are gathered into one array, full blocks
+        sharing a gap type through one NumPy record array, and summed in a
+        single pass.
+        """
+        postings = cls(df)
+        rows = list(rows)
+        if not rows:
+            return postings
+        data, max_tfs, min_lengths = zip(*rows)
+        tail_typecode, tail_count = _BLOCK_HEADER.unpack_from(data[-1])
+        full = len(data) if tail_count == BLOCK else len(data) - 1
+        count = full * BLOCK + (len(data) - full) * tail_count
+        # filled in place through NumPy views of the list's own arrays
+        postings.docs = array("q", [0]) * count
+        postings.tfs = array("B", [0]) * count
+        gaps = numpy.frombuffer(postings.docs, numpy.int64)
+        tfs = numpy.frombuffer(postings.tfs, numpy.uint8)
+        typecodes = numpy.array([block[0] for block in data[:full]], numpy.uint8)
+        for typecode in numpy.unique(typecodes):
+            at = numpy.flatnonzero(typecodes == typecode)
+            if len(at) == full:
+                at = slice(None)
+                joined = b"".join(data[:full])
+            else:
+                joined = b"".join([data[i] for i in at])
+            blocks = numpy.frombuffer(joined, _block_dtype(chr(typecode)))
+            gaps[:full * BLOCK].reshape(full, BLOCK)[at] = blocks["gaps"]
+            tfs[:full * BLOCK].reshape(full, BLOCK)[at] = blocks["tfs"]
+        if full < len(data):
+            offset = _BLOCK_HEADER.size
+            tail = numpy.frombuffer(
+                data[-1], tail_typecode.decode(), tail_count, offset
+            )
+            gaps[full * BLOCK:] = tail
+            tfs[full * BLOCK:] = numpy.frombuffer(
+                data[-1], numpy.uint8, tail_count, offset + tail.nbytes
+            )
+            postings.tail_min_length = min_lengths[-1]
+        numpy.cumsum(gaps, out=gaps)
+        # release the views, so that the arrays can grow
+        del gaps, tfs
+        postings.max_tfs = array("B", max_tfs[:full])
+        postings.min_lengths = array("q", min_lengths[:full])
+        postings.max_tf = max(max_tfs)
+        postings.min_length = min(min_lengths)
+        postings.stored = full
+        return postings
+
+    @classmethod
+    def from_arrays(
+        cls,
+        docs: numpy.ndarray,
+        tfs: numpy.ndarray,
+        lengths: numpy.ndarray,
+        df: int,
+    ) -> "_Postings":
+        """Build a list from its doc numbers, term frequencies and the
+        lengths of those documents."""
+        postings = cls(df)
+        postings.docs.frombytes(docs.astype(numpy.int64).tobytes())
+        postings.tfs.frombytes(tfs.astype(numpy.uint8).tobytes())
+        full = len(docs) // BLOCK * BLOCK
+        if full:
+            max_tfs = tfs[:full].reshape(-1, BLOCK).max(axis=1)
+            min_lengths = lengths[:full].reshape(-1, BLOCK).min(axis=1)
+            postings.max_tfs.frombytes(max_tfs.astype(numpy.uint8).tobytes())
+            postings.min_lengths.frombytes(min_lengths.astype(numpy.int64).tobytes())
+        if len(docs) > full:
+            postings.tail_min_length = int(lengths[full:].min())
+        if len(docs):
+            postings.max_tf = int(tfs.max())
+            postings.min_length = int(lengths.min())
+        return postings
+
+
+class _Term:
+    """A query term's posting list, as NumPy views for a single query.
+
+    Scores take each note's length normalization, ``norm + scale * length``
+    in the notation of :meth:`FullTextIndex.search`, from the caller.
+    """
+
+    __slots__ = (
+        "docs",
+        "tfs",
+        "dense",
+        "weight",
+        "lengths",
+        "norm",
+        "scale",
+        "max_tfs",
+        "min_lengths",
+        "bounds",
+        "ends",
+        "bound",
+    )
+
+    def __init__(
+        self,
+        postings: _Postings,
+        weight: float,
+        lengths: numpy.ndarray,
+        norm: float,
+        scale: float,
+    ) -> None:
+        self.docs, self.tfs = postings.arrays()
+        self.dense = postings.dense(len(lengths))
+        self.weight = weight
+        self.lengths = lengths
+        self.norm = norm
+        self.scale = scale
+        self.max_tfs, self.min_lengths = postings.block_stats()
+        # the highest score a note of each block can get from the term
+        self.bounds = weight * self.max_tfs / (
+            self.max_tfs + norm + scale * self.min_lengths
+        )
+        self.bound = float(self.bounds.max())
+        # the last doc of each block
+        self.ends = self.docs[BLOCK - 1::BLOCK]
+        if len(self.docs) % BLOCK:
+            self.ends = numpy.append(self.ends, self.docs[-1])
+
+    def best(self, count: int) -> numpy.ndarray:
+        """Return the notes holding the largest tf of the ``count`` blocks
+        with the highest bounds."""
+        blocks = numpy.arange(len(self.bounds))
+        if len(blocks) > count:
+            blocks = numpy.argpartition(-self.bounds, count)[:count]
+        at = self._positions(blocks)
+        return self.docs[at[self.tfs[at] == self.max_tfs[at // BLOCK]]]
+
+    def spread(self, count: int) -> Optional[numpy.ndarray]:
+        """Return the term frequencies by doc number if looking ``count``
+        notes up through them is cheaper than by binary search, else None."""
+        if self.dense is None and (
+            16 * count > len(self.docs) + len(self.lengths) // 64
+        ):
+            # a binary search costs about sixteen times as much as spreading
+            # one posting over a dense array of every doc number
+            self.dense = numpy.zeros(len(self.lengths), numpy.uint8)
+            self.dense[self.docs] = self.tfs
+        return self.dense
+
+    def probe(self, docs: numpy.ndarray, norms: numpy.ndarray) -> numpy.ndarray:
+        """Return the term's score for each of ``docs``, 0 for those lacking
+        it."""
+        dense = self.spread(len(docs))
+        if dense is not None:
+            tfs = dense[docs]
+        else:
+            at = numpy.searchsorted(self.docs, docs)
+            at = numpy.minimum(at, len(self.docs) - 1)
+            tfs = numpy.where(self.docs[at] == docs, self.tfs[at], 0)
+        return self.weight * tfs / (tfs + norms)
+
+    def caps(self, docs: numpy.ndarray) -> numpy.ndarray:
+        """Return the bound of the block each of ``docs`` would be in."""
+        at = numpy.searchsorted(self.ends, docs)
+        bounds = self.bounds[numpy.minimum(at, len(self.ends) - 1)]
+        return numpy.where(at < len(self.ends), bounds, 0.0)
+
+    def step(self, need: float) -> Optional[float]:
+        """Return the score of one tf more than the least that scores
+        ``need`` on the term, at its shortest note, or None past its
+        largest tf."""
+        if need >= self.weight:
+            return None
+        shortest = self.norm + self.scale * float(self.min_lengths.min())
+        tf = max(math.ceil(need * shortest / (self.weight - need)), 1) + 1
+        if tf > self.max_tfs.max():
+            return None
+        return self.weight * tf / (tf + shortest)
+
+    def scan(
+        self, need: float
+    ) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Return the live notes that score at least ``need`` on the term,
+        ascending, with those scores and the notes' length normalization."""
+        weight = self.weight
+        if need > weight:
+            empty = numpy.empty(0)
+            return numpy.empty(0, numpy.int64), empty, empty
+        if need > 0:
+            # per block, the smallest tf that can score need at the block's
+            # shortest length; a loose cut, the scores below are exact
+            least = self.norm + self.scale * self.min_lengths
+            least = numpy.ceil(need * least / (weight - need) - 1e-9)
+            least = numpy.clip(least, 1, _MAX_TF).astype(numpy.uint8)
+        if need <= 0 or least.max() == 1:
+            docs, tfs = self.docs, self.tfs
+        else:
+            blocks = numpy.flatnonzero(self.max_tfs >= least)
+            if len(blocks) * 2 < len(least):
+                at = self._positions(blocks)
+                at = at[self.tfs[at] >= least[at // BLOCK]]
+            else:
+                least = numpy.repeat(least, BLOCK)[:len(self.tfs)]
+                at = numpy.flatnonzero(self.tfs >= least)
+            docs, tfs = self.docs[at], self.tfs[at]
+        lengths = self.lengths[docs]
+        norms = self.norm + self.scale * lengths
+        scores = weight * tfs / (tfs + norms)
+        keep = (lengths > 0) & (scores >= need)
+        return docs[keep], scores[keep], norms[keep]
+
+    def _positions(self, blocks: numpy.ndarray) -> numpy.ndarray:
+        """Return the positions of the postings in ``blocks``, ascending."""
+        at = (numpy.sort(blocks)[:, None] * BLOCK + numpy.arange(BLOCK)).ravel()
+        return at[at < len(self.docs)]
+
+
+def _seed(terms: list[_Term], rest: list[float], k: int) -> float:
+    """Return a lower bound for the ``k``-th highest score of a query.
+
+    That is the ``k``-th highest full score among the top notes of each
+    term's best blocks, raised by scoring in full the notes of the first
+    term one tf above the least that could still reach it, for as long as
+    that raises it.
+    """
+    if not terms:
+        return 0.0
+    first, others = terms[0], terms[1:]
+
+    def kth(
+        docs: numpy.ndarray,
+        first_scores: numpy.ndarray,
+        norms: numpy.ndarray,
+        floor: float,
+    ) -> float:
+        scores = sum((term.probe(docs, norms) for term in others), first_scores)
+        return _kth(scores, k, floor)
+
+    docs = numpy.unique(numpy.concatenate([term.best(_SEED_BLOCKS) for term in terms]))
+    lengths = first.lengths[docs]
+    docs, lengths = docs[lengths > 0], lengths[lengths > 0]
+    norms = first.norm + first.scale * lengths
+    threshold = kth(docs, first.probe(docs, norms), norms, 0.0)
+    cut = None
+    while True:
+        last, cut = cut, first.step(threshold - rest[0])
+        if cut is None or cut == last:
+            return threshold
+        raised = kth(*first.scan(cut), threshold)
+        if raised == threshold:
+            return threshold
+        threshold = raised
+
+
+def _top(terms: list[_Term], k: int) -> tuple[list[int], list[float]]:
+    """Return the ``k`` best notes for ``terms`` and their scores, best
+    first."""
+    terms.sort(key=lambda term: term.bound, reverse=True)
+    # rest[i]: the most that the terms after the i-th add to any score
+    rest = list(
+        itertools.accumulate((term.bound for term in reversed(terms)), initial=0.0)
+    )[-2::-1]
+
+    # Candidates, with their scores so far and their length normalization.
+    # A note's score can only miss a term that it was not found in because
+    # it could not have reached the top k with it, so it never makes the
+    # top k.
+    docs = numpy.empty(0, numpy.int64)
+    scores = numpy.empty(0)
+    norms = numpy.empty(0)
+    threshold = _seed(terms, rest, k)
+    for term, later in zip(terms, rest):
+        if len(docs):
+            if term.spread(len(docs)) is None:
+                # drop what cannot make it before the binary searches
+                keep = scores + term.caps(docs) + later >= threshold
+                docs, scores, norms = docs[keep], scores[keep], norms[keep]
+            scores = scores + term.probe(docs, norms)
+            keep = scores + later >= threshold
+            docs, scores, norms = docs[keep], scores[keep], norms[keep]
+            threshold = _kth(scores, k, threshold)
+        # new notes only from postings that could lift one to the threshold
+        new_docs, new_scores, new_norms = term.scan(threshold - later)
+        if len(docs) and len(new_docs):
+            # those already found were scored above
+            fresh = ~numpy.isin(new_docs, docs, kind="table")
+            new_docs = new_docs[fresh]
+            new_scores, new_norms = new_scores[fresh], new_norms[fresh]
+        if len(new_docs):
+            docs = numpy.concatenate([docs, new_docs])
+            scores = numpy.concatenate([scores, new_scores])
+            norms = numpy.concatenate([norms, new_norms])
+            threshold = _kth(scores, k, threshold)
+    if len(docs) > k:
+        top = numpy.argpartition(-scores, k - 1)[:k]
+        docs, scores = docs[top], scores[top]
+    best = numpy.argsort(-scores, kind="stable")
+    return docs[best].tolist(), scores[best].tolist()
+
+
+@dataclass
+class _Changes:
+    """Rows taken by :meth:`FullTextIndex.changes`, ready to be written."""
+
+    removed_docs: list[tuple]
+    added_docs: list[tuple]
+    blocks: list[tuple]
+    # (key, token, first block no longer in use) of rewritten lists
+    truncated: list[tuple]
+    doc_counts: list[tuple]
+    gone: list[tuple]
+    stats: tuple
+
+
+class FullTextIndex:
+    """Incrementally maintained BM25 index stored in SQLite."""
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        collection_name: str = "notes",
+        output_field_name: str = "text_sparse",
+        k1: float = 1.2,
+        b: float = 0.75,
+    ) -> None:
+        self.collection_name = collection_name
+        self.output_field_name = output_field_name
+        self.k1 = k1
+        self.b = b
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        # write() has a connection of its own, so it can run alongside reads
+        self._writer = sqlite3.connect(path, check_same_thread=False)
+        self._write_lock = threading.Lock()
+        # held by edits, and by queries only while they take their snapshot
+        self._lock = threading.Lock()
+
+        self._docs: dict[int, _Doc] = {}
+        # length by doc number, 0 for docs no longer indexed; a flat array
+        # so that queries can look up many at once
+        self._length_of = array("I")
+        self._by_note: dict[str, int] = {}
+        # lists read or created so far, never dropped
+        self._postings: dict[int, _Postings] = {}
+        self._token_num = 0
+        self._next_doc = 1
+
+        self._dirty_tokens: set[int] = set()
+        self._truncated: set[int] = set()
+        self._added_docs: set[int] = set()
+        self._removed_docs: set[int] = set()
+        self._load()
+
+    # -- public API -------------------------------------------------------
+
+    def add(self, note_id: str, text: str, version: float) -> None:
+        """Index ``text`` as the current content of ``note_id``."""
+        counts = Counter(token_id(token) for token in tokenize(text))
+        with self._lock:
+            self._remove(note_id)
+            self._add(note_id, counts, version)
+
+    def remove(self, note_id: str) -> None:
+        with self._lock:
+            self._remove(note_id)
+
+    def search(self, query: str, k: int = 10) -> list[tuple[str, float]]:
+        """Return up to ``k`` ``(note_id, score)`` pairs, best first.
+
+        The lock is held only to take a snapshot of the statistics and the
+        query's posting lists, so queries run alongside each other and
+        alongside edits. A note removed while a query runs is left out of
+        its results.
+        """
+        if k <= 0:
+            return []
+        tokens = {token_id(token) for token in tokenize(query)}
+        with self._lock:
+            unread = [token for token in tokens if token not in self._postings]
+        # A list that was never read has no unwritten changes, so it can be
+        # read without the lock. If an edit reads it meanwhile, the edit's
+        # copy is the one kept.
+        read = [(token, self._read(token)) for token in unread]
+        with self._lock:
+            for token, postings in read:
+                if postings is not None:
+                    self._postings.setdefault(token, postings)
+            n = len(self._docs)
+            if not n:
+                return []
+            k1 = self.k1
+            norm = k1 * (1 - self.b)
+            scale = k1 * self.b * n / self._token_num if self._token_num else 0.0
+            lengths = numpy.frombuffer(self._length_of, numpy.uint32)
+            terms = []
+            for token in tokens:
+                postings = self._postings.get(token)
+                if postings is None or not postings.df:
+                    continue
+                df = postings.df
+                weight = math.log(1 + (n - df + 0.5) / (df + 0.5)) * (k1 + 1)
+                terms.append(_Term(postings, weight, lengths, norm, scale))
+        docs, scores = _top(terms, k)
+        with self._lock:
+            entries = [self._docs.get(doc) for doc in docs]
+        return [
+            (entry.note_id, score)
+            for entry, score in zip(entries, scores)
+            if entry is not None
+        ]
+
+    def versions(self) -> dict[str, float]:
+        """Return the indexed version of every note, keyed by note ID."""
+        with self._lock:
+            return {
+                entry.note_id: entry.version for entry in self._docs.values()
+            }
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def commit(self) -> None:
+        """Write pending changes and statistics in one transaction."""
+        self.write(self.changes())
+
+    def changes(self) -> Optional[_Changes]:
+        """Take the pending changes, or ``None`` if there are none.
+
+        Only blocks sealed since the last commit and the open tails of
+        touched lists are encoded, so edits wait little on this. Pass the
+        result to :meth:`write`.
+        """
+        with self._lock:
+            if not (self._dirty_tokens or self._added_docs or self._removed_docs):
+                return None
+            key = (self.collection_name, self.output_field_name)
+            blocks, truncated, doc_counts, gone = [], [], [], []
+            for token in self._dirty_tokens:
+                postings = self._postings[token]
+                if not postings.df:
+                    gone.append(key + (token,))
+                    continue
+                blocks += [key + (token,) + row for row in postings.unstored()]
+                if token in self._truncated:
+                    truncated.append(key + (token, postings.rows()))
+                doc_counts.append(key + (token, postings.df))
+            changes = _Changes(
+                removed_docs=[key + (doc,) for doc in self._removed_docs],
+                added_docs=[
+                    key + (doc, e.note_id, e.version, e.length, e.tokens.tobytes())
+                    for doc in self._added_docs
+                    for e in (self._docs[doc],)
+                ],
+                blocks=blocks,
+                truncated=truncated,
+                doc_counts=doc_counts,
+                gone=gone,
+                stats=key + (self._token_num, len(self._docs)),
+            )
+            # An emptied list stays behind, so that it is not read back from
+            # rows that are still waiting to be deleted.
+            self._dirty_tokens.clear()
+            self._truncated.clear()
+            self._added_docs.clear()
+            self._removed_docs.clear()
+            return changes
+
+    def write(self, changes: Optional[_Changes]) -> None:
+        """Write changes taken by :meth:`changes` in one transaction.
+
+        This only touches the database, so it may run while the index is
+        edited and searched, but changes must be written in the order they
+        were taken.
+        """
+        if changes is None:
+            return
+        db = self._writer
+        with self._write_lock, db:
+            db.executemany(
+                "DELETE FROM documents WHERE collection_name = ?"
+                " AND output_field_name = ? AND doc = ?",
+                changes.removed_docs,
+            )
+            db.executemany(
+                "INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)",
+                changes.added_docs,
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO postings VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                changes.blocks,
+            )
+            db.executemany(
+                "DELETE FROM postings WHERE collection_name = ?"
+                " AND output_field_name = ? AND token = ? AND block >= ?",
+                changes.truncated,
+            )
+            db.executemany(
+                "INSERT INTO token_doc_count"
+                " (collection_name, output_field_name, token, doc_count)"
+                " VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (collection_name, output_field_name, token)"
+                " DO UPDATE SET doc_count = excluded.doc_count",
+                changes.doc_counts,
+            )
+            for table in ("postings", "token_doc_count"):
+                db.executemany(
+                    f"DELETE FROM {table} WHERE collection_name = ?"
+                    " AND output_field_name = ? AND token = ?",
+                    changes.gone,
+                )
+            db.execute(
+                "INSERT INTO bm25_stats"
+                " (collection_name, output_field_name, token_num, doc_num)"
+                " VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (collection_name, output_field_name)"
+                " DO UPDATE SET token_num = excluded.token_num,"
+                " doc_num = excluded.doc_num",
+                changes.stats,
+            )
+
+    def close(self) -> None:
+        self.commit()
+        self._writer.close()
+        self._db.close()
+
+    # -- internals --------------------------------------------------------
+
+    def _add(self, note_id: str, counts: Counter, version: float) -> None:
+        doc = self._next_doc
+        self._next_doc += 1
+        length = sum(counts.values())
+        for token, tf in counts.items():
+            postings = self._list(token)
+            postings.append(doc, tf, length)
+            postings.df += 1
+            self._dirty_tokens.add(token)
+        self._docs[doc] = _Doc(note_id, version, length, array("q", counts))
+        self._set_length(doc, length)
+        self._by_note[note_id] = doc
+        self._token_num += length
+        self._added_docs.add(doc)
+
+    def _remove(self, note_id: str) -> None:
+        doc = self._by_note.pop(note_id, None)
+        if doc is None:
+            return
+        entry = self._docs.pop(doc)
+        self._length_of[doc] = 0
+        self._token_num -= entry.length
+        tokens = entry.tokens
+        if tokens is None:
+            tokens = self._stored_tokens(doc)
+        for token in tokens:
+            postings = self._list(token)
+            postings.df -= 1
+            if postings.dead > postings.df:
+                self._rewrite(token)
+            self._dirty_tokens.add(token)
+        if doc in self._added_docs:
+            self._added_docs.discard(doc)
+        else:
+            self._removed_docs.add(doc)
+
+    def _list(self, token: int) -> _Postings:
+        postings = self._postings.get(token)
+        if postings is None:
+            postings = self._read(token)
+            if postings is None:
+                postings = _Postings()
+            self._postings[token] = postings
+        return postings
+
+    def _read(self, token: int) -> Optional[_Postings]:
+        key = (self.collection_name, self.output_field_name, token)
+        row = self._db.execute(
+            "SELECT doc_count FROM token_doc_count WHERE collection_name = ?"
+            " AND output_field_name = ? AND token = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return None
+        rows = self._db.execute(
+            "SELECT data, max_tf, min_length FROM postings"
+            " WHERE collection_name = ? AND output_field_name = ? AND token = ?"
+            " ORDER BY block",
+            key,
+        )
+        return _Postings.from_rows(rows, row[0])
+
+    def _stored_tokens(self, doc: int) -> array:
+        (tokens,) = self._db.execute(
+            "SELECT tokens FROM documents WHERE collection_name = ?"
+            " AND output_field_name = ? AND doc = ?",
+            (self.collection_name, self.output_field_name, doc),
+        ).fetchone()
+        return array("q", tokens)
+
+    def _rewrite(self, token: int) -> None:
+        # A doc number only ever grows, and any list still holding a removed
+        # doc keeps a last_doc at or past it, so reloading cannot reuse it.
+        old = self._postings[token]
+        docs, tfs = old.arrays()
+        lengths = numpy.frombuffer(self._length_of, numpy.uint32)[docs]
+        live = lengths > 0
+        self._postings[token] = _Postings.from_arrays(
+            docs[live], tfs[live], lengths[live], old.df
+        )
+        self._truncated.add(token)
+
+    def _set_length(self, doc: int, length: int) -> None:
+        lengths = self._length_of
+        if doc >= len(lengths):
+            # grow geometrically; the new entries are zero
+            zeros = bytes(lengths.itemsize * (doc + 1 + len(lengths)))
+            try:
+                lengths.frombytes(zeros)
+            except BufferError:
+                # a running query holds a view of the old lengths
+                lengths = self._length_of = lengths[:]
+                lengths.frombytes(zeros)
+        lengths[doc] = length
+
+    def _load(self) -> None:
+        key = (self.collection_name, self.output_field_name)
+        for doc, note_id, version, length in self._db.execute(
+            "SELECT doc, note_id, version, length FROM documents"
+            " WHERE collection_name = ? AND output_field_name = ?",
+            key,
+        ):
+            self._docs[doc] = _Doc(note_id, version, length, None)
+            self._set_length(doc, length)
+            self._by_note[note_id] = doc
+            self._token_num += length
+        (last_doc,) = self._db.execute(
+            "SELECT max(last_doc) FROM postings"
+            " WHERE collection_name = ? AND output_field_name = ?",
+            key,
+        ).fetchone()
+        self._next_doc = max(max(self._docs, default=0), last_doc or 0) + 1
+        # dead docs of unrewritten lists may lie past the last live one
+        missing = self._next_doc - len(self._length_of)
+        if missing > 0:
+            self._length_of.frombytes(bytes(self._length_of.itemsize * missing))
+        # The most common tokens' lists are read now: they are few, but the
+        # first query to need one would spend longer reading it than searching.
+        for (token,) in self._db.execute(
+            "SELECT token FROM token_doc_count WHERE collection_name = ?"
+            " AND output_field_name = ? AND doc_count * ? >= ?",
+            key + (_PRELOAD, len(self._docs)),
+        ).fetchall():
+            self._list(token)
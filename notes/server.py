@@ -0,0 +1,468 @@
+"""Asynchronous HTTP API for notes.
+
+Run with::
+
+    python -m notes.server --data data --port 8080
+
+Routes::
+
+    GET    /notes                note summaries, newest first (?limit=&cursor=)
+    POST   /notes                create a note from {"title", "body"}
+    GET    /notes/<id>           fetch a note
+    PUT    /notes/<id>           update "title" and/or "body"
+    DELETE /notes/<id>           delete a note
+    GET    /notes/<id>/related   semantically related notes (?k=)
+    GET    /search               BM25 search (?q=&k=)
+
+Each connection is served by a coroutine on one event loop; storage calls
+run on :class:`StoragePool`, a bounded pool of worker threads, so a slow
+disk read never stalls other connections. Responses carry an ``ETag`` and
+a matching ``If-None-Match`` is answered with ``304 Not Modified``. A
+note's JSON is sent straight from its log record, :data:`STREAM_SLICE`
+bytes at a time, waiting for the socket to drain after each slice, so a
+large note never sits whole in memory behind a slow client.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import binascii
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any, Callable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from notes.service import NotesService
+from notes.storage import Note, NoteNotFound, NoteReader, VersionConflict
+
+log = logging.getLogger(__name__)
+
+STREAM_SLICE = 64 * 1024
+MAX_BODY = 16 * 1024 * 1024
+MAX_HEADER = 64 * 1024
+SUMMARY_LENGTH = 120
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = "") -> None:
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+class StoragePool:
+    """Runs blocking :class:`NotesService` calls on a bounded thread pool."""
+
+    def __init__(self, service: NotesService, size: int = 8) -> None:
+        self.service = service
+        self._executor = ThreadPoolExecutor(size, thread_name_prefix="notes-io")
+
+    async def call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        self.service.close()
+
+
+def etag(*parts: object) -> str:
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def note_etag(note: Note) -> str:
+    """Return a note's ETag, which encodes its ``updated_at`` version."""
+    return version_etag(note.updated_at)
+
+
+def version_etag(updated_at: float) -> str:
+    return f'"{updated_at.hex()}"'
+
+
+def parse_note_etag(tag: str) -> Optional[float]:
+    try:
+        return float.fromhex(tag.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        return None
+
+
+def summary(note: Note) -> dict:
+    return {
+        "id": note.id,
+        "title": note.title,
+        "excerpt": note.body[:SUMMARY_LENGTH],
+        "updated_at": note.updated_at,
+    }
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(
+        self, method: str, target: str, headers: dict[str, str], body: bytes
+    ) -> None:
+        url = urlsplit(target)
+        self.method = method
+        self.path = url.path.rstrip("/") or "/"
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def json(self) -> dict:
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, "body is not valid JSON"
+            ) from None
+        if not isinstance(data, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "body must be a JSON object")
+        return data
+
+    def int_arg(
+        self, name: str, default: int, maximum: int, *, minimum: int = 0
+    ) -> int:
+        try:
+            value = int(self.query.get(name, default))
+        except ValueError:
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, f"{name} must be an integer"
+            ) from None
+        if not minimum <= value <= maximum:
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, f"{name} must be {minimum}..{maximum}"
+            )
+        return value
+
+
+class Response:
+    __slots__ = ("status", "payload", "note", "tag", "headers")
+
+    def __init__(
+        self,
+        status: HTTPStatus = HTTPStatus.OK,
+        payload: Any = None,
+        *,
+        note: Optional[NoteReader] = None,
+        tag: Optional[str] = None,
+        headers: Optional[dict[str, str]] = None,
+    ) -> None:
+        self.status = status
+        self.payload = payload
+        # sent as the body in place of payload; closed once sent
+        self.note = note
+        self.tag = tag
+        self.headers = headers or {}
+
+    def close(self) -> None:
+        if self.note is not None:
+            self.note.close()
+
+
+class NotesServer:
+    def __init__(
+        self,
+        pool: StoragePool,
+        *,
+        keepalive_timeout: float = 75.0,
+    ) -> None:
+        self.pool = pool
+        self.keepalive_timeout = keepalive_timeout
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(
+            self._connection, host, port, limit=MAX_HEADER, backlog=4096
+        )
+
+    # -- routing ----------------------------------------------------------
+
+    async def dispatch(self, request: Request) -> Response:
+        parts = request.path.strip("/").split("/")
+        method = request.method
+        if parts == ["notes"]:
+            if method == "GET":
+                return await self.list_notes(request)
+            if method == "POST":
+                return await self.create_note(request)
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+        if len(parts) == 2 and parts[0] == "notes":
+            if method == "GET":
+                return await self.get_note(parts[1])
+            if method == "PUT":
+                return await self.update_note(parts[1], request)
+            if method == "DELETE":
+                await self.pool.call(self.pool.service.delete, parts[1])
+                return Response(HTTPStatus.NO_CONTENT)
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+        if len(parts) == 3 and parts[0] == "notes" and parts[2] == "related":
+            if method != "GET":
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+            k = request.int_arg("k", 10, 100)
+            hits = await self.pool.call(self.pool.service.related, parts[1], k)
+            return self._hits(hits)
+        if parts == ["search"]:
+            if method != "GET":
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+            query = request.query.get("q", "")
+            k = request.int_arg("k", 10, 100)
+            hits = await self.pool.call(self.pool.service.search, query, k)
+            return self._hits(hits)
+        raise HTTPError(HTTPStatus.NOT_FOUND)
+
+    # -- handlers ---------------------------------------------------------
+
+    async def list_notes(self, request: Request) -> Response:
+        """Return one page of summaries and the cursor for the next page.
+
+        Pages are keyed on the last note's ``(updated_at, id)``, so fetching
+        a page costs the same however deep into the collection it is.
+        """
+        limit = request.int_arg("limit", 50, 1000, minimum=1)
+        cursor = request.query.get("cursor")
+        before = decode_cursor(cursor) if cursor else None
+        items = await self.pool.call(self._page, before, limit)
+        next_cursor = None
+        if len(items) > limit:
+            del items[limit:]
+            last = items[-1]
+            next_cursor = encode_cursor(last["updated_at"], last["id"])
+        keys = [(item["id"], item["updated_at"]) for item in items]
+        tag = etag("list", before, keys)
+        return Response(payload={"notes": items, "next_cursor": next_cursor}, tag=tag)
+
+    def _page(self, before: Optional[tuple[float, str]], limit: int) -> list[dict]:
+        # One extra summary tells whether another page follows.
+        summaries = map(summary, self.pool.service.newest(before))
+        return list(itertools.islice(summaries, limit + 1))
+
+    async def create_note(self, request: Request) -> Response:
+        data = request.json()
+        title, body = data.get("title", ""), data.get("body", "")
+        if not isinstance(title, str) or not isinstance(body, str):
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, "title and body must be strings"
+            )
+        note = await self.pool.call(self.pool.service.create, title, body)
+        return Response(
+            HTTPStatus.CREATED,
+            note.to_dict(),
+            tag=note_etag(note),
+            headers={"Location": f"/notes/{note.id}"},
+        )
+
+    async def get_note(self, note_id: str) -> Response:
+        note = await self.pool.call(self.pool.service.open, note_id, STREAM_SLICE)
+        return Response(note=note, tag=version_etag(note.updated_at))
+
+    async def update_note(self, note_id: str, request: Request) -> Response:
+        data = request.json()
+        fields = {k: data[k] for k in ("title", "body") if k in data}
+        if not all(isinstance(v, str) for v in fields.values()):
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, "title and body must be strings"
+            )
+        if_match = request.headers.get("if-match", "*").strip()
+        if if_match != "*":
+            expected = parse_note_etag(if_match)
+            if expected is None:
+                raise HTTPError(HTTPStatus.PRECONDITION_FAILED)
+            fields["expected_updated_at"] = expected
+        note = await self.pool.call(
+            functools.partial(self.pool.service.update, note_id, **fields)
+        )
+        return Response(payload=note.to_dict(), tag=note_etag(note))
+
+    def _hits(self, hits: list[tuple[Note, float]]) -> Response:
+        items = [dict(summary(note), score=score) for note, score in hits]
+        tag = etag([(n.id, n.updated_at, s) for n, s in hits])
+        return Response(payload={"results": items}, tag=tag)
+
+    # -- HTTP/1.1 ---------------------------------------------------------
+
+    async def _connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        self._read_request(reader), self.keepalive_timeout
+                    )
+                except HTTPError as exc:
+                    await self._send(writer, self._error(exc), close=True)
+                    return
+                if request is None:
+                    return
+                close = request.headers.get("connection", "").lower() == "close"
+                try:
+                    response = await self.dispatch(request)
+                except HTTPError as exc:
+                    response = self._error(exc)
+                except NoteNotFound:
+                    response = self._error(HTTPError(HTTPStatus.NOT_FOUND))
+                except VersionConflict:
+                    response = self._error(
+                        HTTPError(HTTPStatus.PRECONDITION_FAILED)
+                    )
+                except Exception:
+                    log.exception("%s %s failed", request.method, request.path)
+                    response = self._error(
+                        HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR)
+                    )
+                if (
+                    response.tag is not None
+                    and request.method == "GET"
+                    and response.tag in _etags(request.headers.get("if-none-match"))
+                ):
+                    response.close()
+                    response = Response(HTTPStatus.NOT_MODIFIED, tag=response.tag)
+                await self._send(writer, response, close=close)
+                if close:
+                    return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as exc:
+            if exc.partial.strip():
+                raise
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE) from None
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "malformed request line") from None
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        if version == "HTTP/1.0":
+            if headers.get("connection", "").lower() != "keep-alive":
+                headers["connection"] = "close"
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HTTPError(HTTPStatus.NOT_IMPLEMENTED, "chunked request bodies")
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "bad Content-Length")
+        if length > MAX_BODY:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(length) if length else b""
+        return Request(method, target, headers, body)
+
+    def _error(self, exc: HTTPError) -> Response:
+        return Response(exc.status, {"error": str(exc)})
+
+    async def _send(
+        self,
+        writer: asyncio.StreamWriter,
+        response: Response,
+        *,
+        close: bool = False,
+    ) -> None:
+        status = response.status
+        head = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        head += [f"{name}: {value}" for name, value in response.headers.items()]
+        if response.tag is not None:
+            head.append(f"ETag: {response.tag}")
+        if close:
+            head.append("Connection: close")
+        if response.note is not None:
+            await self._send_note(writer, head, response.note)
+            return
+        if response.payload is None:
+            if status not in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED):
+                head.append("Content-Length: 0")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+            await writer.drain()
+            return
+        head.append("Content-Type: application/json")
+        data = json.dumps(response.payload, ensure_ascii=False).encode()
+        head.append(f"Content-Length: {len(data)}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+        await writer.drain()
+
+    async def _send_note(
+        self, writer: asyncio.StreamWriter, head: list[str], note: NoteReader
+    ) -> None:
+        try:
+            head.append("Content-Type: application/json")
+            head.append(f"Content-Length: {note.size}")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + note.first)
+            await writer.drain()
+            # The rest is read only as the client takes it, so a slow
+            # client holds at most a slice of a large note in memory.
+            for start in range(len(note.first), note.size, STREAM_SLICE):
+                writer.write(await self.pool.call(note.read, start, STREAM_SLICE))
+                await writer.drain()
+        finally:
+            note.close()
+
+
+def encode_cursor(updated_at: float, note_id: str) -> str:
+    raw = json.dumps([updated_at, note_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> tuple[float, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        updated_at, note_id = json.loads(raw)
+        updated_at = float(updated_at)
+        if not math.isfinite(updated_at):
+            raise ValueError(updated_at)
+        return updated_at, str(note_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "invalid cursor") from None
+
+
+def _etags(header: Optional[str]) -> set[str]:
+    if not header:
+        return set()
+    return {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+async def _main(args: argparse.Namespace) -> None:
+    pool = StoragePool(NotesService(args.data), size=args.workers)
+    server = await NotesServer(pool).serve(args.host, args.port)
+    log.info("serving notes from %s on %s:%d", args.data, args.host, args.port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the notes HTTP API.")
+    parser.add_argument("--data", default="data", help="notes data directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8, help="storage threads")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Notes service tying the note store to its search indexes.
+
+The note log is the source of truth. Full-text index changes are written to
+SQLite by a background thread every ``index_batch`` writes and on close,
+and embeddings are computed in the background, so neither delays a save.
+If the process dies with either behind, both indexes are reconciled against
+the store's ``updated_at`` stamps on the next open, which only re-reads
+notes that actually changed.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from typing import Iterator, Optional
+
+from notes.embeddings import Embedder, NoteEmbeddings, note_text
+from notes.search import FullTextIndex
+from notes.storage import Note, NoteNotFound, NoteReader, NoteStore
+
+
+def _text(note: Note) -> str:
+    return f"{note.title}\n{note.body}"
+
+
+class NotesService:
+    def __init__(
+        self,
+        directory: str,
+        *,
+        index_batch: int = 1024,
+        embedder: Optional[Embedder] = None,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.index_batch = index_batch
+        self.store = NoteStore(os.path.join(directory, "notes.log"))
+        self.text_index = FullTextIndex(os.path.join(directory, "index.db"))
+        self.embeddings = NoteEmbeddings(
+            os.path.join(directory, "vectors.db"), embedder
+        )
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self._reconcile()
+
+        self._closed = False
+        self._commit_due = threading.Event()
+        self._committer = threading.Thread(
+            target=self._commit_index, name="notes-index", daemon=True
+        )
+        self._committer.start()
+
+    def create(self, title: str, body: str) -> Note:
+        with self._lock:
+            note = self.store.create(title, body)
+            self._indexed(note)
+        return note
+
+    def update(
+        self,
+        note_id: str,
+        *,
+        title: Optional[str] = None,
+        body: Optional[str] = None,
+        expected_updated_at: Optional[float] = None,
+    ) -> Note:
+        """Update a note; see :meth:`NoteStore.update` for the precondition."""
+        with self._lock:
+            note = self.store.update(
+                note_id,
+                title=title,
+                body=body,
+                expected_updated_at=expected_updated_at,
+            )
+            self._indexed(note)
+        return note
+
+    def delete(self, note_id: str) -> None:
+        with self._lock:
+            self.store.delete(note_id)
+            self.text_index.remove(note_id)
+            self.embeddings.schedule_delete(note_id)
+            self._saved()
+
+    def get(self, note_id: str) -> Note:
+        return self.store.get(note_id)
+
+    def open(self, note_id: str, first: int) -> NoteReader:
+        """Return a reader of a note's JSON; see :meth:`NoteStore.open`."""
+        return self.store.open(note_id, first)
+
+    def newest(self, before: Optional[tuple[float, str]] = None) -> Iterator[Note]:
+        """Lazily yield notes, most recently updated first.
+
+        ``before`` is the ``(updated_at, id)`` key of the last note already
+        seen. Notes are read only as the caller consumes them, so taking a
+        page costs the page, not the collection.
+        """
+        for updated_at, note_id in self.store.newest(before):
+            try:
+                note = self.store.get(note_id)
+            except NoteNotFound:
+                continue
+            # Saved again since its key was read; it now sorts ahead of
+            # the walk and belongs to an earlier page.
+            if note.updated_at == updated_at:
+                yield note
+
+    def search(self, query: str, k: int = 10) -> list[tuple[Note, float]]:
+        """Return the ``k`` best BM25 matches for ``query``.
+
+        Searches do not wait on saves: the index locks itself only while
+        it takes a snapshot of the lists the query reads.
+        """
+        return self._notes(self.text_index.search(query, k))
+
+    def related(self, note_id: str, k: int = 10) -> list[tuple[Note, float]]:
+        """Return the ``k`` notes whose embeddings are closest to a note's.
+
+        A note saved moments ago may not be embedded yet, in which case
+        this returns an empty list.
+        """
+        if note_id not in self.store:
+            raise NoteNotFound(note_id)
+        return self._notes(self.embeddings.related(note_id, k))
+
+    def close(self) -> None:
+        self._closed = True
+        self._commit_due.set()
+        self._committer.join()
+        with self._lock:
+            self.embeddings.close()
+            self.text_index.close()
+            self.store.close()
+
+    def __enter__(self) -> "NotesService":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _notes(self, hits: list[tuple[str, float]]) -> list[tuple[Note, float]]:
+        notes = []
+        for note_id, score in hits:
+            try:
+                notes.append((self.store.get(note_id), score))
+            except NoteNotFound:
+                # deleted after the hit was produced
+                continue
+        return notes
+
+    def _indexed(self, note: Note) -> None:
+        self.text_index.add(note.id, _text(note), note.updated_at)
+        self.embeddings.schedule(
+            note.id, note_text(note.title, note.body), note.updated_at
+        )
+        self._saved()
+
+    def _saved(self) -> None:
+        self._unsaved += 1
+        if self._unsaved >= self.index_batch:
+            self._unsaved = 0
+            self._commit_due.set()
+
+    def _commit_index(self) -> None:
+        while True:
+            self._commit_due.wait()
+            self._commit_due.clear()
+            if self._closed:
+                return
+            # Only taking the changes holds up edits; saves go on while
+            # they are written.
+            self.text_index.write(self.text_index.changes())
+
+    def _reconcile(self) -> None:
+        current = self.store.versions()
+        indexed = self.text_index.versions()
+        for note_id in indexed.keys() - current.keys():
+            self.text_index.remove(note_id)
+        for note_id, version in current.items():
+            if indexed.get(note_id) != version:
+                self.text_index.add(
+                    note_id, _text(self.store.get(note_id)), version
+                )
+        self.text_index.commit()
+
+        embedded = self.embeddings.versions()
+        for note_id in embedded.keys() - current.keys():
+            self.embeddings.schedule_delete(note_id)
+        for note_id, version in current.items():
+            if embedded.get(note_id) != version:
+                note = self.store.get(note_id)
+                self.embeddings.schedule(
+                    note_id, note_text(note.title, note.body), version
+                )
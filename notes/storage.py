@@ -0,0 +1,487 @@
+"""Append-only note storage.
+
+Every create, update and delete is appended to a single log file as a
+checksummed record. An in-memory hash index maps each live note ID to the
+offset of its latest record, so writes are one ``write`` call and reads are
+one ``pread`` no matter how large the store grows. :meth:`NoteStore.open`
+reads a note's JSON straight from its record instead, a slice at a time.
+
+Durability is batched: records reach the page cache immediately, and a
+background thread ``fsync``s them every ``sync_interval`` seconds or once
+``sync_batch`` records are pending, whichever comes first. Call
+:meth:`NoteStore.sync` when a write must be on disk before continuing.
+
+The same background thread compacts the log once superseded and deleted
+records make up more than ``compact_ratio`` of it.
+
+Alongside the hash index, the store keeps every note's
+``(updated_at, id)`` key in a sorted list so notes can be listed newest
+first from any cursor position. Saves append their new key (updated times
+only grow, so this is almost always the end of the list) and leave the old
+key in place; :meth:`NoteStore.newest` skips such stale keys, and the list
+is compacted once they make up half of it.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+log = logging.getLogger(__name__)
+
+OP_CREATE = 1
+OP_UPDATE = 2
+OP_DELETE = 3
+_OPS = (OP_CREATE, OP_UPDATE, OP_DELETE)
+
+# crc32 of (op + payload), payload length, op
+_HEADER = struct.Struct("<IIB")
+
+
+class NoteNotFound(KeyError):
+    """Raised when a note ID is not present in the store."""
+
+
+class VersionConflict(Exception):
+    """Raised when a conditional update finds a newer version of the note."""
+
+
+@dataclass(frozen=True)
+class Note:
+    id: str
+    title: str
+    body: str
+    created_at: float
+    updated_at: float
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "title": self.title,
+            "body": self.body,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+def _encode(op: int, payload: dict) -> bytes:
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+    crc = zlib.crc32(data, zlib.crc32(bytes((op,))))
+    return _HEADER.pack(crc, len(data), op) + data
+
+
+def _decode(record: bytes) -> tuple[int, dict]:
+    _, length, op = _HEADER.unpack_from(record)
+    return op, json.loads(record[_HEADER.size:_HEADER.size + length])
+
+
+def _scan(fd: int, start: int, end: int) -> Iterator[tuple[int, int, int, dict]]:
+    """Yield ``(offset, length, op, payload)`` for each intact record.
+
+    Stops at the first truncated or corrupt record; the caller decides
+    what to do with anything past it.
+    """
+    buf = b""
+    at = 0
+    pos = start
+    read_to = start
+    while True:
+        need = _HEADER.size
+        if len(buf) - at >= need:
+            need += _HEADER.unpack_from(buf, at)[1]
+        if len(buf) - at < need:
+            if read_to >= end:
+                return
+            more = os.pread(fd, min(max(1 << 20, need), end - read_to), read_to)
+            if not more:
+                return
+            buf = buf[at:] + more
+            at = 0
+            read_to += len(more)
+            continue
+        crc, length, op = _HEADER.unpack_from(buf, at)
+        data = buf[at + _HEADER.size:at + need]
+        if op not in _OPS or crc != zlib.crc32(data, zlib.crc32(bytes((op,)))):
+            return
+        yield pos, need, op, json.loads(data)
+        at += need
+        pos += need
+
+
+class NoteReader:
+    """The JSON of one version of a note, read from its log record.
+
+    ``first`` holds the first slice, read on opening; :meth:`read` reads
+    the rest. A reader of a note longer than that holds a handle of its own
+    on the log, so compaction swapping the log out does not disturb it,
+    and must be closed.
+    """
+
+    __slots__ = ("updated_at", "size", "first", "_fd", "_offset")
+
+    def __init__(
+        self,
+        updated_at: float,
+        size: int,
+        first: bytes,
+        fd: Optional[int],
+        offset: int,
+    ) -> None:
+        self.updated_at = updated_at
+        self.size = size
+        self.first = first
+        self._fd = fd
+        self._offset = offset
+
+    def read(self, start: int, size: int) -> bytes:
+        """Read up to ``size`` bytes from ``start``, past ``first``, on."""
+        return os.pread(self._fd, min(size, self.size - start), self._offset + start)
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class NoteStore:
+    """Note store backed by an append-only log and an in-memory index."""
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        sync_interval: float = 0.05,
+        sync_batch: int = 256,
+        compact_ratio: float = 0.5,
+        compact_min_bytes: int = 1 << 20,
+    ) -> None:
+        self.path = path
+        self.sync_interval = sync_interval
+        self.sync_batch = sync_batch
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+
+        self._lock = threading.RLock()
+        # Held for the whole of a compaction; only compaction swaps _fd.
+        self._compaction = threading.Lock()
+        # note ID -> (offset, length, updated_at) of its latest record
+        self._index: dict[str, tuple[int, int, float]] = {}
+        self._live_bytes = 0
+        # (updated_at, note ID) ascending; may contain superseded keys
+        self._order: list[tuple[float, str]] = []
+        self._stale = 0
+        self._pending = 0
+        self._closed = False
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._end = self._recover()
+
+        self._wake = threading.Event()
+        self._worker = threading.Thread(
+            target=self._maintain, name="notes-store", daemon=True
+        )
+        self._worker.start()
+
+    # -- public API -------------------------------------------------------
+
+    def create(self, title: str, body: str) -> Note:
+        now = time.time()
+        note = Note(uuid.uuid4().hex, title, body, now, now)
+        self._append(OP_CREATE, note.to_dict())
+        return note
+
+    def update(
+        self,
+        note_id: str,
+        *,
+        title: Optional[str] = None,
+        body: Optional[str] = None,
+        expected_updated_at: Optional[float] = None,
+    ) -> Note:
+        """Update a note, optionally only if it is still at a known version.
+
+        With ``expected_updated_at``, raise :class:`VersionConflict` unless
+        the note's current ``updated_at`` equals it. The check and the
+        append happen under one lock, so two updates from the same version
+        cannot both succeed.
+        """
+        with self._lock:
+            old = self.get(note_id)
+            expected = expected_updated_at
+            if expected is not None and expected != old.updated_at:
+                raise VersionConflict(note_id)
+            note = Note(
+                note_id,
+                old.title if title is None else title,
+                old.body if body is None else body,
+                old.created_at,
+                # strictly increasing, so updated_at can serve as a version
+                max(time.time(), math.nextafter(old.updated_at, math.inf)),
+            )
+            self._append(OP_UPDATE, note.to_dict())
+        return note
+
+    def delete(self, note_id: str) -> None:
+        with self._lock:
+            if note_id not in self._index:
+                raise NoteNotFound(note_id)
+            self._append(OP_DELETE, {"id": note_id})
+
+    def get(self, note_id: str) -> Note:
+        with self._lock:
+            try:
+                offset, length, _ = self._index[note_id]
+            except KeyError:
+                raise NoteNotFound(note_id) from None
+            record = os.pread(self._fd, length, offset)
+        return Note(**_decode(record)[1])
+
+    def open(self, note_id: str, first: int) -> NoteReader:
+        """Return a reader of a note's JSON, which is that of
+        :meth:`Note.to_dict`, with its first ``first`` bytes read."""
+        with self._lock:
+            try:
+                offset, length, updated_at = self._index[note_id]
+            except KeyError:
+                raise NoteNotFound(note_id) from None
+            offset += _HEADER.size
+            size = length - _HEADER.size
+            head = os.pread(self._fd, min(size, first), offset)
+            fd = os.dup(self._fd) if size > len(head) else None
+        return NoteReader(updated_at, size, head, fd, offset)
+
+    def ids(self) -> list[str]:
+        with self._lock:
+            return list(self._index)
+
+    def newest(
+        self, before: Optional[tuple[float, str]] = None, *, batch: int = 256
+    ) -> Iterator[tuple[float, str]]:
+        """Yield ``(updated_at, id)`` keys of live notes, newest first.
+
+        Starts just below ``before`` when given, so the last key of one page
+        is the cursor for the next. Keys are gathered ``batch`` at a time
+        under the store lock and yielded without it; a note saved while the
+        walk is under way moves ahead of the walk and is not yielded again.
+        """
+        while True:
+            with self._lock:
+                order, index = self._order, self._index
+                pos = len(order) if before is None else bisect_left(order, before)
+                keys = []
+                while pos and len(keys) < batch:
+                    pos -= 1
+                    updated_at, note_id = key = order[pos]
+                    entry = index.get(note_id)
+                    if entry is not None and entry[2] == updated_at:
+                        keys.append(key)
+            yield from keys
+            if not pos:
+                return
+            before = keys[-1]
+
+    def versions(self) -> dict[str, float]:
+        """Return ``updated_at`` for every live note, without reading bodies."""
+        with self._lock:
+            return {note_id: entry[2] for note_id, entry in self._index.items()}
+
+    def __contains__(self, note_id: object) -> bool:
+        return note_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def sync(self) -> None:
+        """Flush every pending record to stable storage."""
+        with self._lock:
+            self._sync_locked()
+
+    def compact(self) -> None:
+        """Rewrite the log so it holds only the latest record of each note.
+
+        Live records are copied without holding the store lock; records
+        appended meanwhile are carried over before the new log is swapped
+        in, so writers are only blocked for the final hand-off. Concurrent
+        calls run one after the other.
+        """
+        with self._compaction:
+            self._compact()
+
+    def _compact(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            snapshot = dict(self._index)
+            snapshot_end = self._end
+            # Stable until we swap it below: no other compaction can run.
+            fd = self._fd
+        tmp_path = self.path + ".compact"
+        tmp = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            index: dict[str, tuple[int, int, float]] = {}
+            pos = 0
+            batch: list[bytes] = []
+            batch_bytes = 0
+            for note_id, (offset, length, updated_at) in sorted(
+                snapshot.items(), key=lambda item: item[1][0]
+            ):
+                batch.append(os.pread(fd, length, offset))
+                batch_bytes += length
+                index[note_id] = (pos, length, updated_at)
+                pos += length
+                if batch_bytes >= 1 << 20:
+                    os.write(tmp, b"".join(batch))
+                    batch, batch_bytes = [], 0
+            if batch:
+                os.write(tmp, b"".join(batch))
+
+            with self._lock:
+                if self._closed:
+                    return
+                tail = os.pread(self._fd, self._end - snapshot_end, snapshot_end)
+                os.write(tmp, tail)
+                for offset, length, op, payload in _scan(tmp, pos, pos + len(tail)):
+                    if op == OP_DELETE:
+                        index.pop(payload["id"], None)
+                    else:
+                        index[payload["id"]] = (
+                            offset, length, payload["updated_at"]
+                        )
+                os.fsync(tmp)
+                os.replace(tmp_path, self.path)
+                self._fsync_dir()
+                os.close(self._fd)
+                self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND)
+                os.close(tmp)
+                tmp = -1
+                self._index = index
+                self._end = pos + len(tail)
+                self._live_bytes = sum(entry[1] for entry in index.values())
+                self._pending = 0
+        finally:
+            if tmp >= 0:
+                os.close(tmp)
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._sync_locked()
+        self._wake.set()
+        self._worker.join()
+        with self._compaction:
+            os.close(self._fd)
+
+    def __enter__(self) -> "NoteStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # -- internals --------------------------------------------------------
+
+    def _append(self, op: int, payload: dict) -> None:
+        record = _encode(op, payload)
+        with self._lock:
+            if self._closed:
+                raise ValueError("store is closed")
+            os.write(self._fd, record)
+            self._apply(op, payload, self._end, len(record))
+            self._reorder(op, payload)
+            self._end += len(record)
+            self._pending += 1
+            if self._pending >= self.sync_batch:
+                self._sync_locked()
+
+    def _apply(self, op: int, payload: dict, offset: int, length: int) -> None:
+        note_id = payload["id"]
+        old = self._index.pop(note_id, None)
+        if old is not None:
+            self._live_bytes -= old[1]
+        if op != OP_DELETE:
+            self._index[note_id] = (offset, length, payload["updated_at"])
+            self._live_bytes += length
+
+    def _reorder(self, op: int, payload: dict) -> None:
+        if op != OP_CREATE:
+            self._stale += 1
+        if op != OP_DELETE:
+            key = (payload["updated_at"], payload["id"])
+            if not self._order or key > self._order[-1]:
+                self._order.append(key)
+            else:
+                # the wall clock stepped back
+                insort(self._order, key)
+        if self._stale > 1024 and self._stale * 2 > len(self._order):
+            index = self._index
+            self._order = [
+                key for key in self._order
+                if key[1] in index and index[key[1]][2] == key[0]
+            ]
+            self._stale = 0
+
+    def _recover(self) -> int:
+        size = os.fstat(self._fd).st_size
+        end = 0
+        for offset, length, op, payload in _scan(self._fd, 0, size):
+            self._apply(op, payload, offset, length)
+            end = offset + length
+        if end < size:
+            log.warning(
+                "truncating %d bytes of torn or corrupt records from %s",
+                size - end,
+                self.path,
+            )
+            os.ftruncate(self._fd, end)
+            os.fsync(self._fd)
+        self._order = sorted(
+            (entry[2], note_id) for note_id, entry in self._index.items()
+        )
+        return end
+
+    def _sync_locked(self) -> None:
+        if self._pending:
+            os.fsync(self._fd)
+            self._pending = 0
+
+    def _fsync_dir(self) -> None:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _needs_compaction(self) -> bool:
+        garbage = self._end - self._live_bytes
+        return (
+            garbage >= self.compact_min_bytes
+            and garbage > self.compact_ratio * self._end
+        )
+
+    def _maintain(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.sync_interval)
+            self._wake.clear()
+            with self._lock:
+                if self._closed:
+                    return
+                self._sync_locked()
+                compact = self._needs_compaction()
+            if compact:
+                try:
+                    self.compact()
+                except OSError:
+                    log.exception("compaction of %s failed", self.path)
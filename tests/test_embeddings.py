@@ -0,0 +1,172 @@
+import random
+import threading
+import time
+
+import numpy
+import pytest
+
+import notes.embeddings as embeddings_module
+from notes.embeddings import HashingEmbedder, NoteEmbeddings
+
+
+class FlakyEmbedder(HashingEmbedder):
+    """Fails its first ``failures`` calls."""
+
+    def __init__(self, failures: int) -> None:
+        super().__init__(dim=16)
+        self.failures = failures
+        self.calls = 0
+
+    def embed(self, texts):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError("embedding service unavailable")
+        return super().embed(texts)
+
+
+def test_failed_batches_are_retried(tmp_path):
+    embedder = FlakyEmbedder(failures=2)
+    embeddings = NoteEmbeddings(
+        str(tmp_path / "vectors.db"), embedder, retry_delay=0.01
+    )
+    embeddings.schedule("a", "apple pie", 1.0)
+    embeddings.flush()
+    assert embeddings.versions() == {"a": 1.0}
+    assert embedder.calls == 3
+    embeddings.close()
+
+
+def test_close_gives_up_on_a_failing_batch(tmp_path):
+    path = str(tmp_path / "vectors.db")
+    embeddings = NoteEmbeddings(path, FlakyEmbedder(failures=1000), retry_delay=60)
+    embeddings.schedule("a", "apple pie", 1.0)
+    while not embeddings.embedder.calls:
+        time.sleep(0.01)
+    closer = threading.Thread(target=embeddings.close)
+    closer.start()
+    closer.join(5)
+    assert not closer.is_alive()
+
+    embeddings = NoteEmbeddings(path, HashingEmbedder(dim=16))
+    assert embeddings.versions() == {}
+    embeddings.close()
+
+
+class HeldEmbedder(HashingEmbedder):
+    """Records each batch of texts; calls wait while ``open`` is clear."""
+
+    def __init__(self, version: str = "test-v1") -> None:
+        super().__init__(dim=16)
+        self.version = version
+        self.batches: list[list[str]] = []
+        self.entered = threading.Event()
+        self.open = threading.Event()
+        self.open.set()
+
+    def embed(self, texts):
+        self.entered.set()
+        self.open.wait()
+        self.batches.append(list(texts))
+        return super().embed(texts)
+
+
+def _reference(texts: dict[str, str], query: str, k: int) -> list[float]:
+    embedder = HashingEmbedder(dim=16)
+    vector = numpy.frombuffer(embedder.embed([query])[0], numpy.float32)
+    scores = [
+        float(numpy.frombuffer(v, numpy.float32) @ vector)
+        for v in embedder.embed(list(texts.values()))
+    ]
+    return sorted(scores, reverse=True)[:k]
+
+
+def test_repeated_saves_are_coalesced(tmp_path):
+    embedder = HeldEmbedder()
+    embeddings = NoteEmbeddings(str(tmp_path / "vectors.db"), embedder)
+    embedder.open.clear()
+    embeddings.schedule("first", "held", 1.0)
+    assert embedder.entered.wait(5)
+    # queued behind the held batch, so they make up the next one
+    for version in (1.0, 2.0, 3.0):
+        embeddings.schedule("a", f"apple {version}", version)
+    embeddings.schedule("b", "banana", 1.0)
+    embedder.open.set()
+    embeddings.flush()
+
+    assert embedder.batches == [["held"], ["apple 3.0", "banana"]]
+    assert embeddings.versions() == {"first": 1.0, "a": 3.0, "b": 1.0}
+    embeddings.close()
+
+
+def test_deletes_survive_reload(tmp_path):
+    path = str(tmp_path / "vectors.db")
+    embeddings = NoteEmbeddings(path, HashingEmbedder(dim=16))
+    embeddings.schedule("a", "apple pie recipe", 1.0)
+    embeddings.schedule("b", "apple tart recipe", 1.0)
+    embeddings.schedule("c", "apple crumble recipe", 1.0)
+    embeddings.flush()
+    embeddings.schedule_delete("b")
+    embeddings.schedule_delete("missing")
+    embeddings.flush()
+    related = embeddings.related("a")
+    assert [note_id for note_id, _ in related] == ["c"]
+    assert embeddings.related("b") == []
+    embeddings.close()
+
+    embeddings = NoteEmbeddings(path, HashingEmbedder(dim=16))
+    assert embeddings.versions() == {"a": 1.0, "c": 1.0}
+    assert embeddings.related("a") == related
+    embeddings.close()
+
+
+def test_new_embedder_version_starts_over(tmp_path):
+    path = str(tmp_path / "vectors.db")
+    embeddings = NoteEmbeddings(path, HeldEmbedder("test-v1"))
+    embeddings.schedule("a", "apple", 1.0)
+    embeddings.close()
+
+    embeddings = NoteEmbeddings(path, HeldEmbedder("test-v2"))
+    assert embeddings.versions() == {}
+    embeddings.schedule("b", "banana", 2.0)
+    embeddings.close()
+
+    # the same version again keeps what it wrote
+    embeddings = NoteEmbeddings(path, HeldEmbedder("test-v2"))
+    assert embeddings.versions() == {"b": 2.0}
+    embeddings.close()
+
+
+def test_scores_match_reference_as_rows_die_and_are_rebuilt(tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings_module, "SEGMENT_ROWS", 4)
+    rng = random.Random(0)
+    words = [f"w{i}" for i in range(40)]
+    path = str(tmp_path / "vectors.db")
+    embeddings = NoteEmbeddings(path, HashingEmbedder(dim=16))
+    texts: dict[str, str] = {}
+
+    def check() -> None:
+        assert embeddings.versions().keys() == texts.keys()
+        for _ in range(10):
+            query = " ".join(rng.choices(words, k=3))
+            k = rng.choice([1, 3, 50])
+            got = embeddings.similar(query, k)
+            assert {note_id for note_id, _ in got} <= texts.keys()
+            expected = _reference(texts, query, k)
+            assert [score for _, score in got] == pytest.approx(expected, abs=1e-5)
+
+    for round_ in range(6):
+        for i in range(60):
+            note_id = str(rng.randrange(30))
+            if rng.random() < 0.3:
+                embeddings.schedule_delete(note_id)
+                texts.pop(note_id, None)
+            else:
+                texts[note_id] = " ".join(rng.choices(words, k=5))
+                embeddings.schedule(note_id, texts[note_id], float(i))
+        embeddings.flush()
+        check()
+        if round_ % 2:
+            embeddings.close()
+            embeddings = NoteEmbeddings(path, HashingEmbedder(dim=16))
+            check()
+    embeddings.close()
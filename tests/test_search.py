@@ -0,0 +1,122 @@
+import math
+import random
+import threading
+from collections import Counter
+
+import pytest
+
+import notes.search as search_module
+from notes.search import BLOCK, FullTextIndex, tokenize
+
+
+def _reference(docs: dict[str, str], query: str, k: int) -> list[float]:
+    """Score every note from scratch with the index's BM25 formula."""
+    k1, b = 1.2, 0.75
+    counts = {note_id: Counter(tokenize(text)) for note_id, text in docs.items()}
+    n = len(counts)
+    average = sum(sum(c.values()) for c in counts.values()) / n
+    dfs = Counter(token for c in counts.values() for token in c)
+    scores = []
+    for c in counts.values():
+        length = sum(c.values())
+        score = 0.0
+        for token in set(tokenize(query)):
+            if token in c:
+                idf = math.log(1 + (n - dfs[token] + 0.5) / (dfs[token] + 0.5))
+                tf = min(c[token], 255)
+                score += idf * (k1 + 1) * tf / (
+                    tf + k1 * (1 - b + b * length / average)
+                )
+        if score > 0:
+            scores.append(score)
+    return sorted(scores, reverse=True)[:k]
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_scores_match_reference_after_edits_and_reopen(tmp_path, seed):
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(300)]
+    # Zipf-like, so common terms span many blocks
+    weights = [1 / (i + 1) for i in range(len(vocab))]
+
+    def text() -> str:
+        return " ".join(rng.choices(vocab, weights, k=rng.randint(1, 60)))
+
+    def check(index: FullTextIndex) -> None:
+        for _ in range(30):
+            query = " ".join(rng.choices(vocab, weights, k=rng.randint(1, 4)))
+            k = rng.choice([1, 3, 10, 50])
+            got = [score for _, score in index.search(query, k)]
+            assert got == pytest.approx(_reference(docs, query, k)), query
+
+    path = str(tmp_path / "index.db")
+    docs: dict[str, str] = {}
+    index = FullTextIndex(path)
+    for round_ in range(3):
+        for i in range(1500):
+            note_id = str(rng.randrange(1000))
+            if rng.random() < 0.15:
+                index.remove(note_id)
+                docs.pop(note_id, None)
+            else:
+                docs[note_id] = text()
+                index.add(note_id, docs[note_id], float(round_ * 1500 + i))
+            if rng.random() < 0.002:
+                index.commit()
+        check(index)
+        index.commit()
+        index.close()
+        index = FullTextIndex(path)
+        assert index.versions().keys() == docs.keys()
+        check(index)
+    index.close()
+
+
+def test_close_writes_pending_changes(tmp_path):
+    path = str(tmp_path / "index.db")
+    index = FullTextIndex(path)
+    index.add("a", "apple pie", 1.0)
+    index.commit()
+    index.add("b", "apple tart", 2.0)
+    index.remove("a")
+    assert [note_id for note_id, _ in index.search("apple")] == ["b"]
+    index.close()
+
+    index = FullTextIndex(path)
+    assert [note_id for note_id, _ in index.search("apple")] == ["b"]
+    assert index.versions() == {"b": 2.0}
+    index.close()
+
+
+def test_search_scores_a_snapshot_while_edits_go_on(tmp_path, monkeypatch):
+    index = FullTextIndex(str(tmp_path / "index.db"))
+    index.add("a", "apple pie", 1.0)
+    index.add("b", "apple tart", 2.0)
+
+    scoring, edited = threading.Event(), threading.Event()
+    top = search_module._top
+
+    def paused_top(terms, k):
+        scoring.set()
+        edited.wait()
+        return top(terms, k)
+
+    monkeypatch.setattr(search_module, "_top", paused_top)
+    results = []
+    query = threading.Thread(target=lambda: results.append(index.search("apple")))
+    query.start()
+    assert scoring.wait(5)
+    try:
+        # Edits go on while the query scores, growing the list it holds
+        # views of.
+        index.remove("a")
+        for i in range(3 * BLOCK):
+            index.add(f"new{i}", "apple " * (i % 5 + 1), 3.0)
+    finally:
+        edited.set()
+        query.join()
+
+    assert [note_id for note_id, _ in results[0]] == ["b"]
+    monkeypatch.undo()
+    assert len(index.search("apple", 1000)) == 3 * BLOCK + 1
+    index.close()
@@ -0,0 +1,246 @@
+import asyncio
+import base64
+import json
+from typing import Optional
+
+from notes.server import STREAM_SLICE, NotesServer, StoragePool
+from notes.service import NotesService
+
+
+class Client:
+    """Minimal keep-alive HTTP/1.1 client for the tests."""
+
+    def __init__(self, port: int) -> None:
+        self.port = port
+
+    async def connect(self) -> "Client":
+        self.reader, self.writer = await asyncio.open_connection(
+            "127.0.0.1", self.port
+        )
+        return self
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        payload: Optional[dict] = None,
+        headers: Optional[dict[str, str]] = None,
+    ) -> tuple[int, dict[str, str], Optional[dict]]:
+        body = json.dumps(payload).encode() if payload is not None else b""
+        lines = [f"{method} {path} HTTP/1.1", "Host: test"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        lines.append(f"Content-Length: {len(body)}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        response_headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(":")
+                response_headers[name.strip().lower()] = value.strip()
+        length = int(response_headers.get("content-length", 0))
+        data = await self.reader.readexactly(length)
+        status = int(status_line.split(" ")[1])
+        return status, response_headers, json.loads(data) if data else None
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+def run(tmp_path, test, clients: int = 1) -> None:
+    """Run ``test(*clients)`` against a server on a fresh data directory."""
+
+    async def main() -> None:
+        pool = StoragePool(NotesService(str(tmp_path / "data")))
+        server = await NotesServer(pool).serve("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        connected = [await Client(port).connect() for _ in range(clients)]
+        try:
+            await test(*connected)
+        finally:
+            for client in connected:
+                await client.close()
+            server.close()
+            await server.wait_closed()
+            pool.close()
+
+    asyncio.run(main())
+
+
+def test_etag_revalidation(tmp_path):
+    async def test(client: Client) -> None:
+        _, headers, note = await client.request(
+            "POST", "/notes", {"title": "a", "body": "b"}
+        )
+        path = f"/notes/{note['id']}"
+        tag = headers["etag"]
+        status, _, body = await client.request(
+            "GET", path, None, {"If-None-Match": tag}
+        )
+        assert (status, body) == (304, None)
+
+        status, _, _ = await client.request(
+            "PUT", path, {"body": "c"}, {"If-Match": tag}
+        )
+        assert status == 200
+        status, headers, _ = await client.request(
+            "GET", path, None, {"If-None-Match": tag}
+        )
+        assert status == 200
+        assert headers["etag"] != tag
+
+        for stale in (tag, '"bogus"'):
+            status, _, _ = await client.request(
+                "PUT", path, {"body": "d"}, {"If-Match": stale}
+            )
+            assert status == 412
+        _, _, current = await client.request("GET", path)
+        assert current["body"] == "c"
+
+    run(tmp_path, test)
+
+
+def test_concurrent_if_match_updates_have_one_winner(tmp_path):
+    async def test(*clients: Client) -> None:
+        _, headers, note = await clients[0].request(
+            "POST", "/notes", {"title": "a", "body": "b"}
+        )
+        path = f"/notes/{note['id']}"
+        if_match = {"If-Match": headers["etag"]}
+        responses = await asyncio.gather(
+            *(
+                client.request("PUT", path, {"body": str(i)}, if_match)
+                for i, client in enumerate(clients)
+            )
+        )
+        statuses = sorted(status for status, _, _ in responses)
+        assert statuses == [200] + [412] * (len(clients) - 1)
+        winner = next(body for status, _, body in responses if status == 200)
+        _, _, current = await clients[0].request("GET", path)
+        assert current == winner
+
+    run(tmp_path, test, clients=16)
+
+
+def test_pagination_returns_every_note_once(tmp_path):
+    async def test(client: Client) -> None:
+        created = []
+        for i in range(23):
+            status, _, note = await client.request(
+                "POST", "/notes", {"title": str(i), "body": ""}
+            )
+            assert status == 201
+            created.append(note["id"])
+        # moves to the front, ahead of the walk
+        await client.request("PUT", f"/notes/{created[0]}", {"body": "edited"})
+
+        seen = []
+        path = "/notes?limit=5"
+        while True:
+            status, _, page = await client.request("GET", path)
+            assert status == 200
+            assert len(page["notes"]) <= 5
+            seen += [note["id"] for note in page["notes"]]
+            if page["next_cursor"] is None:
+                break
+            path = f"/notes?limit=5&cursor={page['next_cursor']}"
+        assert seen == [created[0]] + created[:0:-1]
+
+    run(tmp_path, test)
+
+
+def test_listing_rejects_out_of_range_limits(tmp_path):
+    async def test(client: Client) -> None:
+        for limit in ("0", "-1", "1001", "many"):
+            status, _, error = await client.request("GET", f"/notes?limit={limit}")
+            assert status == 400, limit
+            assert "limit" in error["error"]
+        status, _, _ = await client.request("GET", "/notes?cursor=%21")
+        assert status == 400
+        for raw in (b'[NaN,"a"]', b'[-Infinity,"a"]', b'["inf","a"]'):
+            cursor = base64.urlsafe_b64encode(raw).decode()
+            status, _, error = await client.request("GET", f"/notes?cursor={cursor}")
+            assert (status, error) == (400, {"error": "invalid cursor"}), raw
+
+    run(tmp_path, test)
+
+
+def test_large_note_is_sent_in_slices(tmp_path):
+    async def test(client: Client) -> None:
+        body = "ü" * (3 * STREAM_SLICE)
+        _, headers, note = await client.request(
+            "POST", "/notes", {"title": "big", "body": body}
+        )
+        status, got_headers, got = await client.request("GET", f"/notes/{note['id']}")
+        assert (status, got) == (200, note)
+        assert got_headers["etag"] == headers["etag"]
+        assert int(got_headers["content-length"]) > 6 * STREAM_SLICE
+
+        status, _, _ = await client.request(
+            "GET", f"/notes/{note['id']}", None, {"If-None-Match": headers["etag"]}
+        )
+        assert status == 304
+        status, _, _ = await client.request("GET", "/notes/missing")
+        assert status == 404
+
+    run(tmp_path, test)
+
+
+def test_bad_content_length_is_rejected(tmp_path):
+    async def test(client: Client) -> None:
+        for length in ("-1", "x"):
+            client.writer.write(
+                f"POST /notes HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode()
+            )
+            head = await client.reader.readuntil(b"\r\n\r\n")
+            assert head.startswith(b"HTTP/1.1 400 ")
+            assert b"Connection: close" in head
+            await client.reader.read()
+            await client.close()
+            await client.connect()
+
+    run(tmp_path, test)
+
+
+def test_search_and_related_routes(tmp_path):
+    async def test(client: Client) -> None:
+        ids = {}
+        for title, body in [
+            ("milk", "milk eggs flour"),
+            ("cake", "eggs flour sugar butter"),
+            ("car", "tyres oil brakes"),
+        ]:
+            _, _, note = await client.request(
+                "POST", "/notes", {"title": title, "body": body}
+            )
+            ids[title] = note["id"]
+
+        status, headers, found = await client.request("GET", "/search?q=milk")
+        assert status == 200
+        assert [hit["id"] for hit in found["results"]] == [ids["milk"]]
+        assert found["results"][0]["score"] > 0
+        status, _, _ = await client.request(
+            "GET", "/search?q=milk", None, {"If-None-Match": headers["etag"]}
+        )
+        assert status == 304
+        status, _, found = await client.request("GET", "/search?q=flour&k=1")
+        assert status == 200 and len(found["results"]) == 1
+        status, _, _ = await client.request("GET", "/search?q=milk&k=101")
+        assert status == 400
+
+        path = f"/notes/{ids['milk']}/related"
+        # embedded in the background, so wait for it
+        for _ in range(200):
+            status, _, related = await client.request("GET", path)
+            if related["results"]:
+                break
+            await asyncio.sleep(0.05)
+        assert status == 200
+        assert [hit["id"] for hit in related["results"]] == [ids["cake"]]
+        status, _, _ = await client.request("GET", "/notes/missing/related")
+        assert status == 404
+        status, _, _ = await client.request("POST", path)
+        assert status == 405
+
+    run(tmp_path, test)
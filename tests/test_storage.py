@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+
+import pytest
+
+from notes.storage import NoteNotFound, NoteStore, VersionConflict
+
+
+def _contents(store: NoteStore) -> dict[str, tuple[str, str]]:
+    return {
+        note_id: (store.get(note_id).title, store.get(note_id).body)
+        for note_id in store.ids()
+    }
+
+
+def test_torn_tail_is_truncated_on_open(tmp_path):
+    path = str(tmp_path / "notes.log")
+    with NoteStore(path) as store:
+        kept = store.create("kept", "body")
+        store.sync()
+        size = os.path.getsize(path)
+        torn = store.create("torn", "x" * 100)
+    with open(path, "r+b") as f:
+        f.truncate(size + 20)
+
+    with NoteStore(path) as store:
+        assert store.ids() == [kept.id]
+        assert torn.id not in store
+        assert os.path.getsize(path) == size
+        added = store.create("after", "recovery")
+    with NoteStore(path) as store:
+        assert sorted(store.ids()) == sorted([kept.id, added.id])
+
+
+def test_corrupt_tail_record_is_dropped(tmp_path):
+    path = str(tmp_path / "notes.log")
+    with NoteStore(path) as store:
+        kept = store.create("kept", "body")
+        store.sync()
+        size = os.path.getsize(path)
+        store.create("corrupt", "body")
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+    with NoteStore(path) as store:
+        assert store.ids() == [kept.id]
+        assert os.path.getsize(path) == size
+
+
+def test_compaction_during_writes(tmp_path):
+    path = str(tmp_path / "notes.log")
+    store = NoteStore(path, compact_min_bytes=0)
+    notes = [store.create(f"note {i}", "") for i in range(50)]
+    expected = {note.id: (note.title, "") for note in notes}
+    done = threading.Event()
+
+    def write() -> None:
+        for i in range(2000):
+            note = notes[i % len(notes)]
+            if i % 97 == 0 and note.id in expected:
+                store.delete(note.id)
+                del expected[note.id]
+            elif note.id in expected:
+                store.update(note.id, body=str(i))
+                expected[note.id] = (note.title, str(i))
+        done.set()
+
+    def compact() -> None:
+        while not done.is_set():
+            store.compact()
+
+    threads = [threading.Thread(target=write)]
+    threads += [threading.Thread(target=compact) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.compact()
+    assert _contents(store) == expected
+    store.close()
+    assert not os.path.exists(path + ".compact")
+
+    with NoteStore(path) as store:
+        assert _contents(store) == expected
+
+
+def test_update_checks_expected_version(tmp_path):
+    with NoteStore(str(tmp_path / "notes.log")) as store:
+        note = store.create("title", "body")
+        updated = store.update(
+            note.id, body="new", expected_updated_at=note.updated_at
+        )
+        with pytest.raises(VersionConflict):
+            store.update(note.id, body="stale", expected_updated_at=note.updated_at)
+        assert store.get(note.id) == updated
+        with pytest.raises(NoteNotFound):
+            store.update("missing", body="", expected_updated_at=note.updated_at)
+
+
+def test_reader_survives_updates_and_compaction(tmp_path):
+    with NoteStore(str(tmp_path / "notes.log"), compact_min_bytes=0) as store:
+        note = store.create("big", "é" * 100_000)
+        reader = store.open(note.id, 1000)
+        try:
+            store.update(note.id, body="small")
+            store.compact()
+            data = reader.first + b"".join(
+                reader.read(start, 1000)
+                for start in range(len(reader.first), reader.size, 1000)
+            )
+        finally:
+            reader.close()
+        assert json.loads(data) == note.to_dict()
+        assert reader.updated_at == note.updated_at
+
+        small = store.open(note.id, 1000)
+        assert json.loads(small.first) == store.get(note.id).to_dict()
+        small.close()